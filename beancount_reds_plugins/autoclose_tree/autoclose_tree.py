@@ -25,22 +25,148 @@ want to auto close. An example is the `auto_accounts` plugin that ships with Bea
 plugin "beancount.plugins.auto_accounts"
 plugin "beancount.plugins.close_tree"
 ```
+
+Postings (and other references) to an auto-closed descendant dated after its close would only fail later,
+in validation. By default, the plugin reports an error for each such descendant. Alternatively, it can
+move the descendant's close to its last activity date:
+
+```
+plugin "beancount_reds_plugins.autoclose_tree.autoclose_tree" "{
+  'post_close_activity': 'move',  # or 'error' (default), or 'ignore'
+  }"
+```
+
+Optionally, the plugin also finds dead leaf accounts: open accounts without subaccounts whose balance (in
+every currency) has been zero, with no activity, for at least 'zero_balance_days' days before the last
+entry of the ledger. It suggests closing them (reported as errors), or with 'zero_balance_close': True,
+closes them on their last activity date:
+
+```
+plugin "beancount_reds_plugins.autoclose_tree.autoclose_tree" "{
+  'zero_balance_days': 365,
+  'zero_balance_close': False,
+  }"
+```
 """
 
+import bisect
+import collections
+import datetime
 import time
+from ast import literal_eval
 from beancount.core import data
+from beancount.core import getters
 from beancount.core.data import Open, Close
 
 DEBUG = 0
 __plugins__ = ('autoclose_tree',)
 
+AutocloseError = collections.namedtuple('AutocloseError', 'source message entry')
+
+DEFAULT_CONFIG = {
+    'post_close_activity': 'error',
+    'zero_balance_days': None,  # disabled
+    'zero_balance_close': False,
+}
+
+POST_CLOSE_ACTIVITY = ('error', 'move', 'ignore')
+
+# Directives that may reference closed accounts (see beancount.ops.validation)
+ALLOWED_AFTER_CLOSE = (data.Balance, data.Document, data.Note)
+
+
+def descendants(sorted_accounts, account):
+    """Return the descendants of account in sorted_accounts, a sorted list of account names.
+
+    Descendants sort contiguously: after account + ':' and before account + ';', since ';' follows ':'.
+    So they are found with two binary searches, without scanning the other accounts."""
+    lo = bisect.bisect_left(sorted_accounts, account + ':')
+    hi = bisect.bisect_left(sorted_accounts, account + ';', lo)
+    return sorted_accounts[lo:hi]
 
-def autoclose_tree(entries, unused_options_map):
+
+def build_index(entries):
+    """Return a dict mapping opened accounts to their open dates, the set of closed accounts, and a dict
+    mapping each account to the date it was last referenced on (its last activity), in a single traversal of
+    entries."""
+    opens = {}
+    closes = set()
+    last_activity = {}
+    for entry in entries:
+        if isinstance(entry, data.Transaction):
+            for posting in entry.postings:
+                last_activity[posting.account] = entry.date
+        elif isinstance(entry, Open):
+            opens[entry.account] = entry.date
+        elif isinstance(entry, Close):
+            closes.add(entry.account)
+        elif not isinstance(entry, ALLOWED_AFTER_CLOSE):
+            for account in getters.get_entry_accounts(entry):
+                last_activity[account] = entry.date
+    return opens, closes, last_activity
+
+
+def nonzero_balances(entries):
+    """Return the set of accounts with a nonzero balance at the end of entries.
+
+    Balances are kept per account and currency, and updated incrementally in a single traversal. Currencies
+    whose balance returns to zero are dropped, so an account has a zero balance exactly when its dict of
+    balances is empty."""
+    balances = collections.defaultdict(dict)
+    for entry in entries:
+        if not isinstance(entry, data.Transaction):
+            continue
+        for posting in entry.postings:
+            units = posting.units
+            account_balances = balances[posting.account]
+            number = account_balances.get(units.currency, 0) + units.number
+            if number:
+                account_balances[units.currency] = number
+            else:
+                account_balances.pop(units.currency, None)
+    return {account for account, account_balances in balances.items() if account_balances}
+
+
+def zero_balance_closes(entries, sorted_opens, opens, closes, last_activity, days):
+    """Return Close entries for the open leaf accounts at a zero balance, whose last activity is at least days
+    days before the last entry. Each is dated on its account's last activity date (or open date, if it was
+    never used)."""
+    if not entries:
+        return []
+    cutoff = entries[-1].date - datetime.timedelta(days=days)
+    nonzero = nonzero_balances(entries)
+    new_closes = []
+    for account in sorted_opens:
+        if account in closes or account in nonzero or descendants(sorted_opens, account):
+            continue
+        date = last_activity.get(account, opens[account])
+        if date <= cutoff:
+            meta = data.new_metadata('<beancount.plugins.close_tree>', 0)
+            new_closes.append(data.Close(meta, date, account))
+    return new_closes
+
+
+def close_descendant(account, date, last_activity, post_close_activity, errors):
+    """Return a Close for an auto-closed descendant, handling activity after date per post_close_activity."""
+    meta = data.new_metadata('<beancount.plugins.close_tree>', 0)
+    close_entry = data.Close(meta, date, account)
+    last_date = last_activity.get(account)
+    if last_date is not None and last_date > date:
+        if post_close_activity == 'move':
+            close_entry = close_entry._replace(date=last_date)
+        elif post_close_activity == 'error':
+            errors.append(AutocloseError(close_entry.meta, "autoclose_tree: {} is auto-closed on {}, but has "
+                                         "activity until {}".format(account, date, last_date), close_entry))
+    return close_entry
+
+
+def autoclose_tree(entries, unused_options_map, config=None):
     """Insert close entries for all subaccounts of a closed account.
 
     Args:
       entries: A list of directives. We're interested only in the Open/Close instances.
       unused_options_map: A parser options dict.
+      config: An optional config string. See the module docstring.
     Returns:
       A tuple of entries and errors. """
 
@@ -48,23 +174,41 @@ def autoclose_tree(entries, unused_options_map):
     close_count = 0
     new_entries = []
     errors = []
+    config_obj = dict(DEFAULT_CONFIG)
+    if config:
+        config_obj.update(literal_eval(config))
+    post_close_activity = config_obj['post_close_activity']
+    if post_close_activity not in POST_CLOSE_ACTIVITY:
+        return entries, [AutocloseError(data.new_metadata('<beancount.plugins.close_tree>', 0),
+                                        "autoclose_tree: invalid post_close_activity {}, expected one of {}".format(
+                                            post_close_activity, POST_CLOSE_ACTIVITY), None)]
 
-    opens = set(e.account for e in entries if isinstance(e, Open))
-    closes = set(e.account for e in entries if isinstance(e, Close))
+    opens, closes, last_activity = build_index(entries)
+    sorted_opens = sorted(opens)
 
     for entry in entries:
         if isinstance(entry,  Close):
-            subaccounts = [a for a in opens if a.startswith(entry.account + ':') and a not in closes]
+            subaccounts = [a for a in descendants(sorted_opens, entry.account) if a not in closes]
             for subacc in subaccounts:
-                meta = data.new_metadata('<beancount.plugins.close_tree>', 0)
-                close_entry = data.Close(meta, entry.date, subacc)
-                new_entries.append(close_entry)
+                new_entries.append(close_descendant(subacc, entry.date, last_activity, post_close_activity, errors))
                 closes.add(subacc)  # So we don't attempt to re-close a grandchild that a child closed
+                close_count += 1
             if entry.account in opens:
                 new_entries.append(entry)
         else:
             new_entries.append(entry)
 
+    if config_obj['zero_balance_days'] is not None:
+        zero_closes = zero_balance_closes(entries, sorted_opens, opens, closes, last_activity,
+                                          config_obj['zero_balance_days'])
+        if config_obj['zero_balance_close']:
+            new_entries.extend(zero_closes)
+            close_count += len(zero_closes)
+        else:
+            errors.extend(AutocloseError(e.meta, "autoclose_tree: {} has had a zero balance since {}. Suggest: "
+                                         "{} close {}".format(e.account, e.date, e.date, e.account), e)
+                          for e in zero_closes)
+
     if DEBUG:
         elapsed_time = time.time() - start_time
         print("Close account tree [{:.2f}s]: {} close entries added.".format(elapsed_time, close_count))
@@ -1,4 +1,7 @@
+import datetime
+
 import beancount_reds_plugins.autoclose_tree.autoclose_tree as autoclose_tree
+from beancount.core import data
 from beancount.parser import options
 from beancount import loader
 from beancount.parser import cmptest
@@ -166,3 +169,144 @@ class TestCloseTree(cmptest.TestCase):
 
         actual, _ = autoclose_tree.autoclose_tree(entries, {})
         self.assertEqualEntries(actual, expected)
+
+    def test_descendants(self):
+        accounts = sorted(['Assets:XBank', 'Assets:XBank:AAPL', 'Assets:XBank:AAPL:Fuji', 'Assets:XBank-Old',
+                           'Assets:XBank-Old:AAPL', 'Assets:XBankX:AAPL', 'Assets:XBank:ORNG', 'Assets:YBank'])
+        self.assertEqual(['Assets:XBank:AAPL', 'Assets:XBank:AAPL:Fuji', 'Assets:XBank:ORNG'],
+                         autoclose_tree.descendants(accounts, 'Assets:XBank'))
+        self.assertEqual(['Assets:XBank:AAPL:Fuji'], autoclose_tree.descendants(accounts, 'Assets:XBank:AAPL'))
+        self.assertEqual([], autoclose_tree.descendants(accounts, 'Assets:YBank'))
+        self.assertEqual([], autoclose_tree.descendants(accounts, 'Liabilities'))
+
+    def test_post_close_activity(self):
+        entries, _, _ = loader.load_string("""
+            2014-01-01 open Assets:XBank
+            2014-01-01 open Assets:XBank:AAPL
+            2014-01-01 open Assets:XBank:ORNG
+            2014-01-01 open Assets:Bank
+            2015-01-01 close Assets:XBank
+
+            2014-06-01 * "Before close"
+              Assets:XBank:ORNG   10 USD
+              Assets:Bank
+
+            2015-01-01 * "On the close date"
+              Assets:XBank:ORNG   10 USD
+              Assets:Bank
+
+            2015-03-01 * "After close"
+              Assets:XBank:AAPL   10 USD
+              Assets:Bank
+        """, dedent=True)
+
+        actual, errors = autoclose_tree.autoclose_tree(entries, {})
+        self.assertEqual(1, len(errors))
+        self.assertEqual('Assets:XBank:AAPL', errors[0].entry.account)
+
+        actual, errors = autoclose_tree.autoclose_tree(entries, {}, "{'post_close_activity': 'ignore'}")
+        self.assertEqual([], errors)
+
+        actual, errors = autoclose_tree.autoclose_tree(entries, {}, "{'post_close_activity': 'move'}")
+        self.assertEqual([], errors)
+        close_dates = {e.account: e.date for e in actual if isinstance(e, data.Close)}
+        self.assertEqual({'Assets:XBank': datetime.date(2015, 1, 1),
+                          'Assets:XBank:AAPL': datetime.date(2015, 3, 1),
+                          'Assets:XBank:ORNG': datetime.date(2015, 1, 1)}, close_dates)
+
+    def test_balance_after_close(self):
+        entries, _, _ = loader.load_string("""
+            2014-01-01 open Assets:XBank
+            2014-01-01 open Assets:XBank:ORNG
+            2014-01-01 open Assets:Bank
+            2015-01-01 close Assets:XBank
+
+            2014-06-01 * "Before close"
+              Assets:XBank:ORNG   10 USD
+              Assets:Bank
+
+            2014-12-31 * "Empty it"
+              Assets:XBank:ORNG  -10 USD
+              Assets:Bank
+
+            2015-01-02 balance Assets:XBank:ORNG   0 USD
+        """, dedent=True)
+
+        actual, errors = autoclose_tree.autoclose_tree(entries, {})
+        self.assertEqual([], errors)
+
+        actual, errors = autoclose_tree.autoclose_tree(entries, {}, "{'post_close_activity': 'move'}")
+        close_dates = {e.account: e.date for e in actual if isinstance(e, data.Close)}
+        self.assertEqual(datetime.date(2015, 1, 1), close_dates['Assets:XBank:ORNG'])
+
+    def test_zero_balance(self):
+        entries, _, _ = loader.load_string("""
+            2014-01-01 open Assets:Bank
+            2014-01-01 open Assets:Brokerage
+            2014-01-01 open Assets:Brokerage:AAPL
+            2014-01-01 open Assets:Brokerage:ORNG
+            2014-01-01 open Assets:Brokerage:Unused
+            2014-01-01 open Assets:Brokerage:Closed
+            2014-01-01 open Equity:Opening-Balances
+            2014-06-01 close Assets:Brokerage:Closed
+
+            2014-02-01 * "Buy"
+              Assets:Brokerage:AAPL   10 AAPL {1 USD}
+              Assets:Brokerage:ORNG   10 ORNG {1 USD}
+              Assets:Bank
+
+            2014-03-01 * "Sell all AAPL"
+              Assets:Brokerage:AAPL  -10 AAPL {1 USD}
+              Assets:Bank             10 USD
+
+            2015-06-01 * "Deposit"
+              Assets:Bank             10 USD
+              Equity:Opening-Balances
+        """, dedent=True)
+
+        # Disabled by default
+        _, errors = autoclose_tree.autoclose_tree(entries, {})
+        self.assertEqual([], errors)
+
+        _, errors = autoclose_tree.autoclose_tree(entries, {}, "{'zero_balance_days': 365}")
+        self.assertEqual(['Assets:Brokerage:AAPL', 'Assets:Brokerage:Unused'], [e.entry.account for e in errors])
+
+        actual, errors = autoclose_tree.autoclose_tree(
+            entries, {}, "{'zero_balance_days': 365, 'zero_balance_close': True}")
+        self.assertEqual([], errors)
+        close_dates = {e.account: e.date for e in actual if isinstance(e, data.Close)}
+        self.assertEqual({'Assets:Brokerage:Closed': datetime.date(2014, 6, 1),
+                          'Assets:Brokerage:AAPL': datetime.date(2014, 3, 1),
+                          'Assets:Brokerage:Unused': datetime.date(2014, 1, 1)}, close_dates)
+
+        # Not for long enough
+        _, errors = autoclose_tree.autoclose_tree(entries, {}, "{'zero_balance_days': 500}")
+        self.assertEqual(['Assets:Brokerage:Unused'], [e.entry.account for e in errors])
+
+    def test_zero_balance_sibling_with_dash(self):
+        # 'Assets:Brokerage-Old' sorts between 'Assets:Brokerage' and 'Assets:Brokerage:AAPL'
+        entries, _, _ = loader.load_string("""
+            2014-01-01 open Assets:Bank
+            2014-01-01 open Assets:Brokerage
+            2014-01-01 open Assets:Brokerage-Old
+            2014-01-01 open Assets:Brokerage:AAPL
+
+            2015-06-01 * "Deposit"
+              Assets:Bank             10 USD
+              Assets:Brokerage:AAPL  -10 USD
+        """, dedent=True)
+
+        _, errors = autoclose_tree.autoclose_tree(entries, {}, "{'zero_balance_days': 30}")
+        self.assertEqual(['Assets:Brokerage-Old'], [e.entry.account for e in errors])
+
+        actual, _ = autoclose_tree.autoclose_tree(entries, {}, "{'zero_balance_days': 30, 'zero_balance_close': True}")
+        self.assertEqual(['Assets:Brokerage-Old'], [e.account for e in actual if isinstance(e, data.Close)])
+
+    def test_invalid_post_close_activity(self):
+        entries, _, _ = loader.load_string("""
+            2014-01-01 open Assets:XBank:AAPL
+            2015-01-01 close Assets:XBank
+        """, dedent=True)
+        actual, errors = autoclose_tree.autoclose_tree(entries, {}, "{'post_close_activity': 'mvoe'}")
+        self.assertEqual(1, len(errors))
+        self.assertIs(entries, actual)
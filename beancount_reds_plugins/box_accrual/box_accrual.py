@@ -1,12 +1,63 @@
-"""TODO"""
-
-from datetime import date
+"""Prorates synthetic loan (box spread) capital losses across calendar years (or months, or days). See
+accompanying README.md
+
+Invoke it in your beancount source this way:
+plugin "beancount_reds_plugins.box_accrual.box_accrual"
+
+or with a config (all keys optional, defaults shown):
+plugin "beancount_reds_plugins.box_accrual.box_accrual" "{
+    'expiry_key': 'synthetic_loan_expiry',
+    'accounts': [':Capital-Losses$'],
+    'quantum': None,
+    'granularity': 'yearly',
+    'emit_effective_date': False,
+    'holding_accounts': None,
+    }"
+
+  expiry_key: the transaction metadata key holding the loan's expiry date
+  accounts: regexps searched for in posting accounts, to find the loss posting to split
+  quantum: the precision splits are rounded to, eg: '0.01'. If None, the inferred_tolerance_default option
+    for the loss currency (if set) determines it, else cents
+  granularity: 'yearly', 'monthly' or 'daily': the periods losses are split into. Periods end on the last
+    day of the year/month, or on the expiry date
+  emit_effective_date: if True, emit the final transactions the effective_date plugin would create from
+    the split postings (the trade with the splits moved to holding accounts, one transaction per period,
+    and Open directives for the holding accounts) directly, instead of split postings with effective_date
+    metadata
+  holding_accounts: the holding accounts config for emit_effective_date, in the effective_date plugin's
+    format. Defaults to the effective_date plugin's default
+"""
+
+import calendar
+import collections
+import functools
+import itertools
+import re
+from ast import literal_eval
+from datetime import date, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 from beancount.core import data, amount
+from beancount_reds_plugins.common import common
+from beancount_reds_plugins.effective_date import effective_date
 
 PLUGIN_NAME = "beancount_reds_plugins.box_accrual.box_accrual"
 __plugins__ = ("box_accrual",)
 
+DEFAULT_CONFIG = {
+    'expiry_key': 'synthetic_loan_expiry',
+    'accounts': [':Capital-Losses$'],
+    'quantum': None,
+    'granularity': 'yearly',
+    'emit_effective_date': False,
+    'holding_accounts': None,
+}
+
+GRANULARITIES = ('yearly', 'monthly', 'daily')
+
+BoxAccrualError = collections.namedtuple('BoxAccrualError', 'source message entry')
+
+DEFAULT_QUANTUM = Decimal("0.01")
+
 
 def _as_date(val):
     if isinstance(val, date):
@@ -16,76 +67,185 @@ def _as_date(val):
     return None
 
 
-def box_accrual(entries, unused_options_map, config):
+def build_config(config):
+    config_obj = dict(DEFAULT_CONFIG)
+    if config:
+        config_obj.update(literal_eval(config))
+    return config_obj
+
+
+def compile_accounts(patterns):
+    """Return a function telling whether an account is a loss account to split. All patterns are combined
+    into one regexp, and results are memoized per account."""
+    regexp = re.compile('|'.join('(?:{})'.format(p) for p in patterns))
+    memo = {}
+
+    def is_loss_account(account):
+        try:
+            return memo[account]
+        except KeyError:
+            memo[account] = result = regexp.search(account) is not None
+            return result
+    return is_loss_account
+
+
+def make_quantizer(quantum, options_map):
+    """Return a function mapping a currency to the quantum its splits are rounded to: the configured one,
+    else the power of ten at or below twice the currency's inferred_tolerance_default (eg: cents for a
+    tolerance of 0.005), else cents."""
+    if quantum is not None:
+        quantum = Decimal(quantum)
+        return lambda currency: quantum
+    tolerances = (options_map or {}).get('inferred_tolerance_default') or {}
+
+    @functools.lru_cache(maxsize=None)
+    def quantum_for(currency):
+        tolerance = tolerances.get(currency, tolerances.get('*'))
+        if tolerance is None:
+            return DEFAULT_QUANTUM
+        return Decimal(1).scaleb((2 * Decimal(tolerance)).adjusted())
+    return quantum_for
+
+
+def period_ends(start, expiry, granularity):
+    """Yield the end date of each period of the loan from start to expiry: the last day of each year or
+    month, or each day. The last period ends on expiry."""
+    if granularity == 'daily':
+        for days in range((expiry - start).days + 1):
+            yield start + timedelta(days=days)
+        return
+    year, month = start.year, start.month
+    while True:
+        if granularity == 'monthly':
+            end = date(year, month, calendar.monthrange(year, month)[1])
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        else:
+            end = date(year, 12, 31)
+            year += 1
+        if end >= expiry:
+            yield expiry
+            return
+        yield end
+
+
+@functools.lru_cache(maxsize=4096)
+def period_table(start, expiry, granularity):
+    """The period end dates of period_ends(), as a tuple. Memoized, since many trades share a period (eg:
+    same trade date and expiry). Not used for daily periods, which are cheaper to generate than to store."""
+    if expiry < start:
+        return ()
+    return tuple(period_ends(start, expiry, granularity))
+
+
+def periods(start, expiry, granularity):
+    """Return an iterator over the period end dates of the loan from start to expiry (none if expiry is
+    before start)."""
+    if granularity == 'daily':
+        return period_ends(start, expiry, granularity) if expiry > start else iter(())
+    return iter(period_table(start, expiry, granularity))
+
+
+def _div_round_half_up(n, d):
+    """n / d for integers (d > 0), rounded half away from zero, like ROUND_HALF_UP."""
+    q = (2 * abs(n) + d) // (2 * d)
+    return q if n >= 0 else -q
+
+
+def split_amounts(total, start, expiry, ends, quantum):
+    """Yield (period end, amount) for each period end in ends, prorating total by day count.
+
+    Amounts are computed in integer multiples of quantum: each period gets the rounded cumulative amount up
+    to its end, minus that of the previous periods. So amounts add up to total (rounded to quantum) exactly,
+    rounding errors don't accumulate, and nothing is quantized per period. Periods whose amount rounds to zero
+    are skipped."""
+    exponent = quantum.as_tuple().exponent
+    scaled = int(total.scaleb(-exponent).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    total_days = (expiry - start).days + 1
+    previous = 0
+    for end in ends:
+        cumulative = _div_round_half_up(scaled * ((end - start).days + 1), total_days)
+        if cumulative != previous:
+            yield end, Decimal(cumulative - previous).scaleb(exponent)
+        previous = cumulative
+
+
+def split_postings(loss_p, start, expiry, ends, quantum):
+    """Lazily split loss_p into one posting per period ending in ends. See split_amounts()."""
+    ccy = loss_p.units.currency
+    for seg_end, seg_amt in split_amounts(Decimal(loss_p.units.number), start, expiry, ends, quantum):
+        yield data.Posting(
+            account=loss_p.account,
+            units=amount.Amount(seg_amt, ccy),
+            cost=None,
+            price=None,
+            flag=None,
+            meta={"effective_date": seg_end},
+        )
+
+
+def emit_effective_dated(entry, resolve, out, new_accounts, errors):
+    """Append the entries the effective_date plugin would create from entry, whose split postings carry
+    effective_date metadata, to out. The effective date metadata (including that of any other postings
+    with an effective_date_range) is then dropped from the trade's holding postings, so that running the
+    effective_date plugin afterwards leaves them alone."""
+    effective_date.split_entry(entry, resolve, out, new_accounts, errors)
+    trade = out[-1]
+    out[-1] = trade._replace(postings=[
+        effective_date.cleaned(p)
+        if effective_date.has_valid_effective_date(p) or effective_date.has_effective_date_range(p) else p
+        for p in trade.postings])
+
+
+def box_accrual(entries, options_map, config):
+    config_obj = build_config(config)
+    expiry_key = config_obj['expiry_key']
+    is_loss_account = compile_accounts(config_obj['accounts'])
+    quantum_for = make_quantizer(config_obj['quantum'], options_map)
+    granularity = config_obj['granularity']
+    if granularity not in GRANULARITIES:
+        return entries, [BoxAccrualError(data.new_metadata(PLUGIN_NAME, 0), "box_accrual: invalid granularity {}, "
+                                         "expected one of {}".format(granularity, GRANULARITIES), None)]
+
+    resolve = None
+    if config_obj['emit_effective_date']:
+        resolve = effective_date.compile_config(config_obj['holding_accounts'] or effective_date.DEFAULT_HOLDING_ACCTS)
+    new_accounts = set()
+    errors = []
+
     out = []
     for entry in entries:
         if not isinstance(entry, data.Transaction):
             out.append(entry)
             continue
 
-        expiry_raw = entry.meta.get("synthetic_loan_expiry")
-        expiry_date = _as_date(expiry_raw)
+        expiry_date = _as_date(entry.meta.get(expiry_key))
         if not expiry_date:
             out.append(entry)
             continue
 
-        # Find the single Capital-Losses posting
-        losses = [p for p in entry.postings if p.account.endswith(":Capital-Losses")]
+        # Find the single loss posting
+        losses = [p for p in entry.postings if is_loss_account(p.account)]
         if len(losses) != 1:
             out.append(entry)
             continue
 
-        loss_p = losses[0]
-        total_loss = Decimal(loss_p.units.number)
-        ccy = loss_p.units.currency
-        start = entry.date
-
-        if start.year == expiry_date.year:
-            out.append(entry)
-            continue
-
-        # Inclusive day count
-        total_days = (expiry_date - start).days + 1
-        if total_days <= 0:
+        # Nothing to split within a single period, or for an expiry before the trade
+        ends = periods(entry.date, expiry_date, granularity)
+        first_end = next(ends, expiry_date)
+        if first_end >= expiry_date:
             out.append(entry)
             continue
 
-        # Build year splits
-        fractions = []
-        for year in range(start.year, expiry_date.year + 1):
-            seg_start = max(start, date(year, 1, 1))
-            seg_end = min(expiry_date, date(year, 12, 31))
-            seg_days = (seg_end - seg_start).days + 1
-            if seg_days <= 0:
-                continue
-            fractions.append((year, seg_days, seg_end))
-
-        # Calculate and round each year's loss
-        splits = []
-        rounded_sum = Decimal("0.00")
-        for i, (year, seg_days, seg_end) in enumerate(fractions):
-            frac = Decimal(seg_days) / Decimal(total_days)
-            seg_amt = total_loss * frac
-            if i < len(fractions) - 1:
-                seg_amt = seg_amt.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-                rounded_sum += seg_amt
-            else:
-                # Final segment = whatever remainder keeps totals exact
-                seg_amt = total_loss - rounded_sum
-                seg_amt = seg_amt.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-
-            splits.append(
-                data.Posting(
-                    account=loss_p.account,
-                    units=amount.Amount(seg_amt, ccy),
-                    cost=None,
-                    price=None,
-                    flag=None,
-                    meta={"effective_date": seg_end},
-                )
-            )
-
-        new_postings = [p for p in entry.postings if p is not loss_p] + splits
-        out.append(entry._replace(postings=new_postings))
-
-    return out, []
+        loss_p = losses[0]
+        splits = split_postings(loss_p, entry.date, expiry_date, itertools.chain((first_end,), ends),
+                                quantum_for(loss_p.units.currency))
+        new_postings = [p for p in entry.postings if p is not loss_p]
+        new_postings.extend(splits)
+        if resolve is None:
+            out.append(entry._replace(postings=new_postings))
+        else:
+            emit_effective_dated(entry._replace(postings=new_postings), resolve, out, new_accounts, errors)
+
+    if new_accounts:
+        out.extend(common.create_open_directives(new_accounts, entries, meta_desc='<box_accrual>'))
+    return out, errors
@@ -2,6 +2,7 @@ from datetime import date
 from decimal import Decimal
 from beancount.loader import load_string
 from beancount_reds_plugins.box_accrual import box_accrual
+from beancount_reds_plugins.effective_date import effective_date
 
 
 def test_box_accrual_two_year_split():
@@ -41,3 +42,138 @@ def test_box_accrual_two_year_split():
     for p in losses:
         assert p.cost is None
         assert p.price is None
+
+
+def test_box_accrual_config():
+    input_text = """
+    option "inferred_tolerance_default" "USD:0.5"
+
+    2025-09-25 * "SPX 18DEC26" "Box Borrow 100k"
+      loan_expiry: 2027-06-30
+      Assets:Investments:Taxable:IBKR-Original-1572:USD                        95,000 USD
+      Liabilities:Loans:BoxSpreadLoans                           -100,000 USD
+      Expenses:Interest:BoxTrades                                  5000 USD
+    """
+
+    entries, _, options = load_string(input_text)
+    config = "{'expiry_key': 'loan_expiry', 'accounts': ['^Expenses:Interest:']}"
+    new_entries, _ = box_accrual.box_accrual(entries, options, config)
+    txn = [e for e in new_entries if e.__class__.__name__ == "Transaction"][0]
+
+    splits = [p for p in txn.postings if p.account == "Expenses:Interest:BoxTrades"]
+    assert [p.meta["effective_date"] for p in splits] == [date(2025, 12, 31), date(2026, 12, 31), date(2027, 6, 30)]
+
+    # Rounded to whole dollars, per the inferred tolerance option
+    assert [p.units.number for p in splits] == [Decimal("761"), Decimal("2834"), Decimal("1405")]
+
+    # An explicit quantum wins
+    config = "{'expiry_key': 'loan_expiry', 'accounts': ['^Expenses:Interest:'], 'quantum': '0.01'}"
+    new_entries, _ = box_accrual.box_accrual(entries, options, config)
+    txn = [e for e in new_entries if e.__class__.__name__ == "Transaction"][0]
+    splits = [p for p in txn.postings if p.account == "Expenses:Interest:BoxTrades"]
+    assert [p.units.number for p in splits] == [Decimal("760.87"), Decimal("2833.85"), Decimal("1405.28")]
+
+
+def test_box_accrual_tolerance_multiplier():
+    input_text = """
+    option "inferred_tolerance_default" "*:0.005"
+    option "inferred_tolerance_multiplier" "1.1"
+
+    2025-09-25 * "SPX 18DEC26" "Box Borrow 100k"
+      synthetic_loan_expiry: 2026-12-18
+      Assets:Investments:Taxable:IBKR-Original-1572:USD                        95,000 USD
+      Liabilities:Loans:BoxSpreadLoans                           -100,000 USD
+      Income:Investments:Taxable:BoxTrades:Capital-Losses         5000 USD
+    """
+    entries, _, options = load_string(input_text)
+    assert options["inferred_tolerance_multiplier"] == Decimal("1.1")
+
+    # The multiplier doesn't affect the quantum: still cents
+    new_entries, errors = box_accrual.box_accrual(entries, options, None)
+    assert errors == []
+    splits = [p for p in new_entries[-1].postings if p.account.endswith(":Capital-Losses")]
+    assert [p.units.number for p in splits] == [Decimal("1088.89"), Decimal("3911.11")]
+
+    assert box_accrual.make_quantizer(None, {'inferred_tolerance_default': {'USD': Decimal("0.003")}})(
+        "USD") == Decimal("0.001")
+
+
+def test_period_table():
+    ends = box_accrual.period_table(date(2025, 9, 25), date(2026, 12, 18), "yearly")
+    assert ends == (date(2025, 12, 31), date(2026, 12, 18))
+    assert box_accrual.period_table(date(2025, 9, 25), date(2026, 12, 18), "yearly") is ends
+
+    ends = box_accrual.period_table(date(2025, 11, 15), date(2026, 2, 10), "monthly")
+    assert ends == (date(2025, 11, 30), date(2025, 12, 31), date(2026, 1, 31), date(2026, 2, 10))
+
+    assert box_accrual.period_table(date(2025, 1, 1), date(2025, 12, 31), "yearly") == (date(2025, 12, 31),)
+    assert box_accrual.period_table(date(2025, 1, 1), date(2024, 12, 31), "yearly") == ()
+
+
+def test_box_accrual_monthly_and_daily():
+    input_text = """
+    2025-11-15 * "SPX" "Box Borrow"
+      synthetic_loan_expiry: 2026-02-10
+      Assets:Brokerage                                     99,000 USD
+      Liabilities:Loans:BoxSpreadLoans                   -100,000 USD
+      Income:BoxTrades:Capital-Losses                       1,000 USD
+    """
+    entries, _, options = load_string(input_text)
+
+    new_entries, _ = box_accrual.box_accrual(entries, options, "{'granularity': 'monthly'}")
+    splits = [p for p in new_entries[-1].postings if p.account.endswith(":Capital-Losses")]
+    assert [p.meta["effective_date"] for p in splits] == [
+        date(2025, 11, 30), date(2025, 12, 31), date(2026, 1, 31), date(2026, 2, 10)]
+    # 88 days: 16, 31, 31 and 10 days
+    assert [p.units.number for p in splits] == [
+        Decimal("181.82"), Decimal("352.27"), Decimal("352.27"), Decimal("113.64")]
+
+    new_entries, _ = box_accrual.box_accrual(entries, options, "{'granularity': 'daily'}")
+    splits = [p for p in new_entries[-1].postings if p.account.endswith(":Capital-Losses")]
+    assert len(splits) == 88
+    assert splits[0].meta["effective_date"] == date(2025, 11, 15)
+    assert splits[-1].meta["effective_date"] == date(2026, 2, 10)
+    assert sum(p.units.number for p in splits) == Decimal("1000")
+    # Rounding errors don't accumulate: each day is within a cent of the exact amount
+    assert all(abs(p.units.number - Decimal(1000) / 88) < Decimal("0.01") for p in splits)
+
+    _, errors = box_accrual.box_accrual(entries, options, "{'granularity': 'weekly'}")
+    assert len(errors) == 1
+
+
+def test_box_accrual_emit_effective_date():
+    input_text = """
+    2025-01-01 open Assets:Brokerage
+    2025-01-01 open Liabilities:Loans:BoxSpreadLoans
+    2025-01-01 open Income:BoxTrades:Capital-Losses
+    2025-01-01 open Expenses:Fees
+
+    2025-11-15 * "SPX" "Box Borrow"
+      synthetic_loan_expiry: 2026-02-10
+      Assets:Brokerage                                     98,988 USD
+      Liabilities:Loans:BoxSpreadLoans                   -100,000 USD
+      Income:BoxTrades:Capital-Losses                       1,000 USD
+      Expenses:Fees                                            12 USD
+        effective_date_range: "2025-12-01..2026-02-28"
+    """
+    entries, _, options = load_string(input_text)
+
+    def summary(entries):
+        return sorted((e.date, type(e).__name__, getattr(e, "account", None),
+                       tuple((p.account, p.units) for p in getattr(e, "postings", ()))) for e in entries)
+
+    # Same result as running the effective_date plugin on the split postings
+    split_entries, _ = box_accrual.box_accrual(entries, options, "{'granularity': 'monthly'}")
+    expected, errors = effective_date.effective_date(split_entries, options, None)
+    assert errors == []
+    config = "{'granularity': 'monthly', 'emit_effective_date': True}"
+    actual, errors = box_accrual.box_accrual(entries, options, config)
+    assert errors == []
+    assert summary(actual) == summary(expected)
+    # The trade, a transaction per month for the loss, and a transaction per month for the fees
+    assert len([e for e in actual if e.__class__.__name__ == "Transaction"]) == 8
+
+    # Running the effective_date plugin afterwards leaves the emitted entries alone
+    rerun, errors = effective_date.effective_date(actual, options, None)
+    assert errors == []
+    assert rerun is actual
@@ -0,0 +1,156 @@
+"""Benchmarks for long_short and gain_loss on synthetic, lot-heavy brokerage ledgers.
+
+Run with:
+    python -m beancount_reds_plugins.capital_gains_classifier.benchmark_capital_gains --lots 1 100 1000
+
+Prints one JSON line per measurement: each plugin end to end, both in sequence, and per-sale latency
+percentiles of rebooking a single sale.
+"""
+
+import argparse
+import datetime
+import random
+import time
+
+from ast import literal_eval
+from beancount.core import data
+from beancount.core.amount import Amount
+from beancount.core.number import D
+from beancount.core.position import Cost
+from beancount_reds_plugins.capital_gains_classifier import gain_loss as gl
+from beancount_reds_plugins.capital_gains_classifier import long_short as ls
+from beancount_reds_plugins.capital_gains_classifier import prefilter
+from beancount_reds_plugins.common import benchmark
+
+LONG_SHORT_CONFIG = """{
+    'Income.*:Capital-Gains': [':Capital-Gains', ':Capital-Gains:Short', ':Capital-Gains:Long'],
+    }"""
+
+GAIN_LOSS_CONFIG = """{
+    'Income.*:Capital-Gains:Long.*':  [':Long',  ':Long:Gains',  ':Long:Losses'],
+    'Income.*:Capital-Gains:Short.*': [':Short', ':Short:Gains', ':Short:Losses'],
+    }"""
+
+
+def generate_ledger(lots_per_sale, sales_per_year, years=5, num_accounts=10, seed=1):
+    """Generate a brokerage ledger: each sale reduces lots_per_sale lots, each bought in a separate
+    transaction over the two years before the sale, so that sales mix short and long term lots.
+
+    Args:
+      lots_per_sale: number of lots reduced by each sale
+      sales_per_year: number of sales per year, across all accounts
+      years: number of years of sales
+      num_accounts: number of brokerage accounts, each with its own commodity and gains account
+      seed: random seed, so runs are comparable
+    Returns:
+      A list of entries sorted by date, starting with the Open directives.
+    """
+    rng = random.Random(seed)
+    start = datetime.date(2000, 1, 1)
+    first_sale = start + datetime.timedelta(days=731)
+    tolerances = {'USD': D('0.005')}
+
+    def meta(lineno):
+        m = data.new_metadata('<benchmark>', lineno)
+        m['__tolerances__'] = tolerances
+        return m
+
+    def txn(date, narration, postings):
+        return data.Transaction(meta(0), date, '*', None, narration, data.EMPTY_SET, data.EMPTY_SET, postings)
+
+    accounts = ['Assets:Brokerage:A{}'.format(k) for k in range(num_accounts)]
+    gains_accounts = ['Income:Capital-Gains:A{}'.format(k) for k in range(num_accounts)]
+    entries = [data.Open(meta(0), start, account, None, None)
+               for account in accounts + gains_accounts + ['Assets:Bank']]
+    transactions = []
+    for s in range(sales_per_year * years):
+        k = rng.randrange(num_accounts)
+        commodity = 'STK{}'.format(k)
+        sale_date = first_sale + datetime.timedelta(days=s * 365 // sales_per_year)
+        lots = []
+        for _ in range(lots_per_sale):
+            date = sale_date - datetime.timedelta(days=rng.randrange(1, 731))
+            units = D(rng.randrange(1, 100))
+            cost = Cost(D(rng.randrange(1000, 10000)) / 100, 'USD', date, None)
+            transactions.append(txn(date, 'Buy', [
+                data.Posting(accounts[k], Amount(units, commodity), cost, None, None, None),
+                data.Posting('Assets:Bank', Amount(-units * cost.number, 'USD'), None, None, None, None)]))
+            lots.append((units, cost))
+
+        price = Amount(D(rng.randrange(1000, 10000)) / 100, 'USD')
+        postings = [data.Posting(accounts[k], Amount(-units, commodity), cost, price, None, None)
+                    for units, cost in lots]
+        proceeds = sum(units * price.number for units, _ in lots)
+        gains = sum(units * (cost.number - price.number) for units, cost in lots)
+        postings.append(data.Posting('Assets:Bank', Amount(proceeds, 'USD'), None, None, None, None))
+        postings.append(data.Posting(gains_accounts[k], Amount(gains, 'USD'), None, None, None, None))
+        transactions.append(txn(sale_date, 'Sell', postings))
+
+    transactions.sort(key=data.entry_sortkey)
+    return entries + transactions
+
+
+def per_sale_latencies(entries):
+    """Time rebooking each sale on its own: long_short, then gain_loss on the result. Modifies entries."""
+    match_rule, rules = ls.compile_rules(literal_eval(LONG_SHORT_CONFIG))
+    classify = ls.make_classifier(match_rule, rules)
+    rewrite = gl.make_rewriter(gl.compile_rewrites(literal_eval(GAIN_LOSS_CONFIG)))
+
+    long_short_times, gain_loss_times = [], []
+    for i in prefilter.candidates(entries, lambda account: classify(account)[0] is not None):
+        start = time.perf_counter()
+        ls.rebook_entry(entries[i], classify, rules)
+        long_short_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        entries[i], _ = gl.rebook_entry(entries[i], rewrite)
+        gain_loss_times.append(time.perf_counter() - start)
+    return long_short_times, gain_loss_times
+
+
+def run(lots_per_sale, sales_per_year, years, num_accounts, repeat):
+    params = dict(lots_per_sale=lots_per_sale, sales_per_year=sales_per_year, years=years,
+                  accounts=num_accounts)
+
+    # long_short modifies its input in place, so each run gets a fresh ledger
+    def setup():
+        return generate_ledger(lots_per_sale, sales_per_year, years, num_accounts)
+
+    # gain_loss rebooks the short/long accounts long_short creates, so its input is long_short's output
+    def setup_gain_loss():
+        entries, _ = ls.long_short(setup(), {}, LONG_SHORT_CONFIG)
+        return entries
+
+    def in_sequence(entries):
+        entries, _ = ls.long_short(entries, {}, LONG_SHORT_CONFIG)
+        gl.gain_loss(entries, {}, GAIN_LOSS_CONFIG)
+
+    long_short_times, gain_loss_times = per_sale_latencies(setup())
+    return [
+        benchmark.measure('long_short', lambda entries: ls.long_short(entries, {}, LONG_SHORT_CONFIG),
+                          setup=setup, repeat=repeat, **params),
+        benchmark.measure('gain_loss', lambda entries: gl.gain_loss(entries, {}, GAIN_LOSS_CONFIG),
+                          setup=setup_gain_loss, repeat=repeat, **params),
+        benchmark.measure('long_short+gain_loss', in_sequence, setup=setup, repeat=repeat, **params),
+        benchmark.percentiles('long_short_per_sale', long_short_times, **params),
+        benchmark.percentiles('gain_loss_per_sale', gain_loss_times, **params),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lots', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--sales-per-year', type=int, nargs='+', default=[50, 500])
+    parser.add_argument('--accounts', type=int, nargs='+', default=[1, 20])
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for lots_per_sale in args.lots:
+        for sales_per_year in args.sales_per_year:
+            for num_accounts in args.accounts:
+                benchmark.report(run(lots_per_sale, sales_per_year, args.years, num_accounts, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,8 @@
 
 import re
 import time
-from beancount.core import data
 from ast import literal_eval
+from beancount_reds_plugins.capital_gains_classifier import prefilter
 from beancount_reds_plugins.common import common
 # from beancount.parser import printer
 
@@ -12,13 +12,56 @@ DEBUG = 0
 __plugins__ = ('gain_loss',)
 
 
-def account_replace(txn, posting, new_account):
-    """replace the account on a given posting with a new account"""
-    # create a new posting with the new account, then remove old and add new
-    # from parent transaction
-    new_posting = posting._replace(account=new_account)
-    txn.postings.remove(posting)
-    txn.postings.append(new_posting)
+def compile_rewrites(rewrites):
+    """Return a list of (compiled <key>, <substring_to_replace>, <replacement_for_gains>,
+    <replacement_for_losses>) tuples for a gain_loss config dict."""
+    return [(re.compile(r), sub, gains_repl, losses_repl) for r, (sub, gains_repl, losses_repl) in rewrites.items()]
+
+
+def make_rewriter(account_matches):
+    """Return a function mapping (account, is_gain) to the account a posting should be rebooked to, or
+    None if no rule matches. Rules are applied in order, each to the result of the previous one.
+
+    Memoized, since a ledger has few distinct gains accounts but many postings to them."""
+    memo = {}
+
+    def rewrite(account, is_gain):
+        key = (account, is_gain)
+        try:
+            return memo[key]
+        except KeyError:
+            pass
+        new_account = None
+        for pat, sub, gains_repl, losses_repl in account_matches:
+            candidate = account if new_account is None else new_account
+            if pat.match(candidate):
+                new_account = candidate.replace(sub, gains_repl if is_gain else losses_repl)
+        memo[key] = new_account
+        return new_account
+    return rewrite
+
+
+def rebook_entry(entry, rewrite):
+    """Rebook the postings of entry into gains or losses accounts, per rewrite (see make_rewriter()).
+
+    Postings keep their order. entry is left untouched: a new transaction is returned only if a posting
+    was rewritten.
+
+    Returns:
+      A tuple of the (possibly new) entry, and the list of accounts rewritten to.
+    """
+    rewritten = []
+    postings = None
+    for i, posting in enumerate(entry.postings):
+        account = rewrite(posting.account, posting.units.number < 0)  # Income is negative
+        if account is not None:
+            if postings is None:
+                postings = list(entry.postings)
+            postings[i] = posting._replace(account=account)
+            rewritten.append(account)
+    if postings is None:
+        return entry, rewritten
+    return entry._replace(postings=postings), rewritten
 
 
 def gain_loss(entries, options_map, config):
@@ -37,26 +80,23 @@ def gain_loss(entries, options_map, config):
 
     start_time = time.time()
     rewrite_count = 0
-    new_accounts = []
+    new_accounts = set()
     errors = []
-    rewrites = literal_eval(config)
-    account_matches = [(r, re.compile(r)) for r in rewrites]
-
-    for entry in entries:
-        if isinstance(entry, data.Transaction):
-            postings = list(entry.postings)
-            for posting in postings:
-                account = posting.account
-                for r, pat in account_matches:
-                    if pat.match(account):
-                        if posting.units.number < 0:
-                            account = account.replace(rewrites[r][0], rewrites[r][1])  # gains
-                        else:
-                            account = account.replace(rewrites[r][0], rewrites[r][2])  # losses
-                        rewrite_count += 1
-                        if account not in new_accounts:
-                            new_accounts.append(account)
-                        account_replace(entry, posting, account)
+    rewrite = make_rewriter(compile_rewrites(literal_eval(config)))
+
+    # Gains postings are rebooked whether or not the transaction is a sale. Whether a rule matches doesn't
+    # depend on the sign
+    def is_gains_account(account):
+        return rewrite(account, True) is not None
+
+    # Only the affected transactions are replaced, in a copy of the list. The rest are shared with the input
+    positions = prefilter.candidates(entries, is_gains_account, require_sale=False)
+    if positions:
+        entries = list(entries)
+    for i in positions:
+        entries[i], rewritten = rebook_entry(entries[i], rewrite)
+        rewrite_count += len(rewritten)
+        new_accounts.update(rewritten)
 
     new_open_entries = common.create_open_directives(new_accounts, entries, meta_desc="gains_losses")
     if DEBUG:
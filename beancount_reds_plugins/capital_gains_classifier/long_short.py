@@ -9,117 +9,215 @@ Invoke it in your beancount source this way:
 
 Example:
 plugin "long_short" "{
-    'Income.*:Taxable:Capital-Gains:' : [':Capital-Gains', ':Capital-Gains:Short', ':Capital-Gains:Long']
+    'Income.*:Taxable:Capital-Gains:' : [':Capital-Gains', ':Capital-Gains:Short', ':Capital-Gains:Long'],
+    'Income.*:Trust:Capital-Gains:' : [':Capital-Gains', ':Capital-Gains:ST', ':Capital-Gains:LT'],
     }"
 
-Currently, only a single match_regexp in the dictionary is supported. Additional keys will be ignored.
-
-TODO:
-    - support multiple pattern/replacement/replacement sets. Via regexp or via lists
+Any number of match_regexps may be specified. They are compiled into a single regexp, so each posting
+account is matched once, regardless of the number of rules (unless some use inline flags or
+backreferences, in which case they are matched one by one). If an account matches more than one
+match_regexp, the first one listed wins. If a transaction has postings matching different rules, only
+those matching the first such posting's rule are rebooked.
 
 """
 
+import collections
+import datetime
+import functools
 import re
 import time
 
-from beancount.core import data
 from ast import literal_eval
-from dateutil import relativedelta
+from beancount.core import data
+from beancount_reds_plugins.capital_gains_classifier import prefilter
 from beancount_reds_plugins.common import common
 
 DEBUG = 0
 __plugins__ = ('long_short',)
 
-
-def long_short(entries, options_map, config):  # noqa: C901
+LongShortError = collections.namedtuple('LongShortError', 'source message entry')
+
+
+@functools.lru_cache(maxsize=4096)
+def first_long_term_date(acquisition_date):
+    """The earliest sale date on which a lot acquired on acquisition_date is held long term: the day after
+    its first anniversary. A lot acquired on Feb 29 has its anniversary on Feb 28. See the IRS definition at
+    the bottom of this file.
+
+    Memoized, since lots acquired on the same dates (eg: via dividend reinvestment) are sold over and
+    over."""
+    try:
+        return acquisition_date.replace(year=acquisition_date.year + 1) + datetime.timedelta(days=1)
+    except ValueError:  # Feb 29
+        return datetime.date(acquisition_date.year + 1, 3, 1)
+
+
+def sale_type(p, entry_date):
+    gain = (p.cost.number - p.price.number) * abs(p.units.number)  # Income is negative
+    return entry_date >= first_long_term_date(p.cost.date), gain
+
+
+def gains_by_term(lots, sale_date):
+    """Return (short_gains, long_gains) for lots (reduction postings with a price) sold on sale_date."""
+    sale_types = [sale_type(p, sale_date) for p in lots]
+    short_gains = sum(s[1] for s in sale_types if s[0] is False)
+    long_gains = sum(s[1] for s in sale_types) - short_gains
+    return short_gains, long_gains
+
+
+def compile_rules(config_obj):
+    """Compile all match_regexps into one alternation regexp, with a named group per rule.
+
+    Returns a function mapping an account to the name of the first rule whose match_regexp matches it (or
+    None), and a dict mapping each rule name to the rule's
+    (substring_to_replace, replacement_for_short-term, replacement_for_long-term).
+
+    match_regexps that can't be combined (eg: with inline flags, or backreferences, which would refer to the
+    wrong groups) are instead matched one by one, in order. Raises re.error for an invalid match_regexp."""
+    rules = {'_rule{}'.format(i): tuple(repls) for i, repls in enumerate(config_obj.values())}
+    regexes = list(config_obj)
+    if not any(re.search(r'\\\d|\(\?P=', regex) for regex in regexes):
+        try:
+            acct_match = re.compile('|'.join('(?P<_rule{}>{})'.format(i, regex) for i, regex in enumerate(regexes)))
+        except re.error:  # eg: inline global flags, which are only allowed at the start
+            pass
+        else:
+            def match_rule(account):
+                m = acct_match.match(account)
+                return m.lastgroup if m else None
+            return match_rule, rules
+
+    compiled = [('_rule{}'.format(i), re.compile(regex)) for i, regex in enumerate(regexes)]
+
+    def match_rule_in_order(account):
+        for name, regex in compiled:
+            if regex.match(account):
+                return name
+        return None
+    return match_rule_in_order, rules
+
+
+def make_classifier(match_rule, rules):
+    """Return a function mapping an account to (name of the rule it matches or None, rules whose
+    short/long replacements it contains). Accounts repeat across the ledger, so each distinct account is
+    classified only once."""
+    classifications = {}
+
+    def classify(account):
+        try:
+            return classifications[account]
+        except KeyError:
+            pass
+        shortlong_rules = frozenset(name for name, (_, short_repl, long_repl) in rules.items()
+                                    if short_repl in account or long_repl in account)
+        classifications[account] = match_rule(account), shortlong_rules
+        return classifications[account]
+    return classify
+
+
+def generic_gains_postings(entry, classify):
+    """Return the name of the rule matched by the first matching posting, and all postings matching
+    that rule. The rule is None if there are none, or if the entry already contains short/long
+    postings for that rule."""
+    rule = None
+    matched = []
+    shortlong_rules = set()
+    for posting in entry.postings:
+        posting_rule, posting_shortlong_rules = classify(posting.account)
+        shortlong_rules.update(posting_shortlong_rules)
+        if posting_rule is not None:
+            if rule is None:
+                rule = posting_rule
+            if posting_rule == rule:
+                matched.append(posting)
+    if rule in shortlong_rules:
+        return None, []
+    return rule, matched
+
+
+def rebook_entry(entry, classify, rules):
+    """Replace the generic capital gains postings of entry with short and/or long term ones, in place.
+
+    Returns the accounts of the postings added, if any."""
+
+    # identify reduction transactions
+    # determine long vs short for each lot
+    # replace cap gains account with above
+
+    rule, orig_gains_postings = generic_gains_postings(entry, classify)
+    if rule is None:
+        return []
+    account_to_replace, short_account_repl, long_account_repl = rules[rule]
+
+    # If the entry doesn't contain a price (p.price == None), it will remain in the parent
+    # (:Capital-Gains) account, which can make it a pain to debug. At least warn the user
+    # somehow, or collect these in a separate error account
+    lots = [p for p in entry.postings if prefilter.is_priced_reduction(p)]
+    if not lots:
+        return []
+    short_gains, long_gains = gains_by_term(lots, entry.date)
+
+    # record and remove generic capital gains postings
+    orig_sum = sum(p.units.number for p in orig_gains_postings)
+    for p in orig_gains_postings:
+        entry.postings.remove(p)
+
+    # ensure our replacement postings sum up to the original capital gains postings we removed
+    diff = orig_sum - (short_gains + long_gains)
+    # divide this diff among short/long. TODO: warn if this is over tolerance threshold, because it
+    # means that the transaction is probably not accounted for correctly
+    if abs(diff) >= entry.meta['__tolerances__'][p.units.currency]:
+        total = short_gains + long_gains
+        short_gains += (short_gains/total) * diff
+        long_gains += (long_gains/total) * diff
+
+    orig_p = orig_gains_postings[0]
+    added = []
+
+    def add_posting(gains, account_repl):
+        new_units = orig_p.units._replace(number=gains)
+        new_account = orig_p.account.replace(account_to_replace, account_repl)
+        added.append(new_account)
+        new_posting = orig_p._replace(account=new_account, units=new_units)
+        entry.postings.append(new_posting)
+
+    # create and add upto two new postings
+    if short_gains:
+        add_posting(short_gains, short_account_repl)
+    if long_gains:
+        add_posting(long_gains, long_account_repl)
+    return added
+
+
+def long_short(entries, options_map, config):
     """Replace :Capital-Gains: in transactions with :Capital-Gains:Short: and/or :Capital-Gains:Long:
     """
 
     start_time = time.time()
-    rewrite_count_matches = rewrite_count_short = rewrite_count_long = 0
+    rewrite_count_matches = rewrite_count_postings = 0
     new_accounts = set()
     errors = []
 
-    config_obj = literal_eval(config)
-    acct_match_regex = next(iter(config_obj))
-    acct_match = re.compile(acct_match_regex)
-    account_to_replace, short_account_repl, long_account_repl = config_obj[acct_match_regex]
-
-    def contains_shortlong_postings(entry):
-        return any(short_account_repl in posting.account or long_account_repl in posting.account
-                   for posting in entry.postings)
-
-    def contains_generic(entry):
-        return any(acct_match.match(posting.account) for posting in entry.postings)
-
-    def is_interesting_entry(entry):
-        return contains_generic(entry) and not contains_shortlong_postings(entry)
-
-    def reductions(entry):
-        # If the entry doesn't contain a price (p.price == None), it will remain in the parent
-        # (:Capital-Gains) account, which can make it a pain to debug. At least warn the user
-        # somehow, or collect these in a separate error account
-        return [p for p in entry.postings if (p.cost and p.units.number and p.price is not None)]
-
-    def sale_type(p, entry_date):
-        diff = relativedelta.relativedelta(entry_date, p.cost.date)
-        gain = (p.cost.number - p.price.number) * abs(p.units.number)  # Income is negative
-        # relativedelta is used to account for leap years. IRS' definition is at the bottom of the file
-        return diff.years > 1 or (diff.years == 1 and (diff.months >= 1 or diff.days >= 1)), gain
-
-    for entry in entries:
-
-        # identify reduction transactions
-        # determine long vs short for each lot
-        # replace cap gains account with above
+    try:
+        match_rule, rules = compile_rules(literal_eval(config))
+    except re.error as e:
+        return entries, [LongShortError(data.new_metadata('<long_short>', 0),
+                                        "long_short: invalid match_regexp: {}".format(e), None)]
+    classify = make_classifier(match_rule, rules)
 
-        if isinstance(entry, data.Transaction) and is_interesting_entry(entry):
+    for i in prefilter.candidates(entries, lambda account: classify(account)[0] is not None):
+        added = rebook_entry(entries[i], classify, rules)
+        if added:
             rewrite_count_matches += 1
-            sale_types = [sale_type(p, entry.date) for p in reductions(entry)]
-            if not sale_types:
-                continue
-            short_gains = sum(s[1] for s in sale_types if s[0] is False)
-            long_gains = sum(s[1] for s in sale_types) - short_gains
-
-            # record and remove generic capital gains postings
-            orig_gains_postings = [p for p in entry.postings if acct_match.match(p.account)]
-            orig_sum = sum(p.units.number for p in orig_gains_postings)
-            for p in orig_gains_postings:
-                entry.postings.remove(p)
-
-            # ensure our replacement postings sum up to the original capital gains postings we removed
-            diff = orig_sum - (short_gains + long_gains)
-            # divide this diff among short/long. TODO: warn if this is over tolerance threshold, because it
-            # means that the transaction is probably not accounted for correctly
-            if abs(diff) >= entry.meta['__tolerances__'][p.units.currency]:
-                total = short_gains + long_gains
-                short_gains += (short_gains/total) * diff
-                long_gains += (long_gains/total) * diff
-
-            orig_p = orig_gains_postings[0]
-
-            def add_posting(gains, account_repl):
-                new_units = orig_p.units._replace(number=gains)
-                new_account = orig_p.account.replace(account_to_replace, account_repl)
-                new_accounts.add(new_account)
-                new_posting = orig_p._replace(account=new_account, units=new_units)
-                entry.postings.append(new_posting)
-
-            # create and add upto two new postings
-            if short_gains:
-                add_posting(short_gains, short_account_repl)
-                rewrite_count_short += 1
-
-            if long_gains:
-                add_posting(long_gains, long_account_repl)
-                rewrite_count_long += 1
+            rewrite_count_postings += len(added)
+            new_accounts.update(added)
 
     # create open entries
     new_open_entries = common.create_open_directives(new_accounts, entries, meta_desc='<long_short>')
     if DEBUG:
         elapsed_time = time.time() - start_time
-        print("Long/short gains classifier [{:.2f}s]: {} matched. {} short, {} long postings added.".format(
-              elapsed_time, rewrite_count_matches, rewrite_count_short, rewrite_count_long))
+        print("Long/short gains classifier [{:.2f}s]: {} matched. {} short/long postings added.".format(
+              elapsed_time, rewrite_count_matches, rewrite_count_postings))
     return new_open_entries + entries, errors
 
 # IRS references:
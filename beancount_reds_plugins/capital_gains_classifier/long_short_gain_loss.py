@@ -0,0 +1,75 @@
+"""Rebooks capital gains into short-term/long-term and gains/losses accounts in a single pass.
+
+Equivalent to running the long_short plugin followed by the gain_loss plugin, but traversing the ledger
+once, and creating Open directives in a single pass. Invoke it with the configs of both plugins:
+
+plugin "beancount_reds_plugins.capital_gains_classifier.long_short_gain_loss" "{
+  'long_short': {
+    'Income.*:Taxable:Capital-Gains': [':Capital-Gains', ':Capital-Gains:Short', ':Capital-Gains:Long'],
+  },
+  'gain_loss': {
+    'Income.*:Taxable:Capital-Gains:Long.*':  [':Long',  ':Long:Gains',  ':Long:Losses'],
+    'Income.*:Taxable:Capital-Gains:Short.*': [':Short', ':Short:Gains', ':Short:Losses'],
+  },
+ }"
+
+See long_short.py and gain_loss.py for the format of each. Unlike running the two plugins in sequence,
+Open directives are only created for the accounts that end up being used, and not for the intermediate
+short/long accounts that gain_loss rebooks away.
+"""
+
+import re
+import time
+from ast import literal_eval
+from beancount.core import data
+from beancount_reds_plugins.capital_gains_classifier import gain_loss
+from beancount_reds_plugins.capital_gains_classifier import long_short
+from beancount_reds_plugins.capital_gains_classifier import prefilter
+from beancount_reds_plugins.common import common
+
+DEBUG = 0
+__plugins__ = ('long_short_gain_loss',)
+
+
+def long_short_gain_loss(entries, options_map, config):
+    """Replace :Capital-Gains: in transactions with short/long term gains/losses accounts."""
+
+    start_time = time.time()
+    rewrite_count = 0
+    new_accounts = set()
+    used_accounts = set()
+    errors = []
+
+    config_obj = literal_eval(config)
+    try:
+        match_rule, rules = long_short.compile_rules(config_obj.get('long_short', {}))
+    except re.error as e:
+        return entries, [long_short.LongShortError(data.new_metadata('<long_short_gain_loss>', 0),
+                                                   "long_short_gain_loss: invalid match_regexp: {}".format(e), None)]
+    classify = long_short.make_classifier(match_rule, rules)
+    rewrite = gain_loss.make_rewriter(gain_loss.compile_rewrites(config_obj.get('gain_loss', {})))
+
+    def is_gains_account(account):
+        return classify(account)[0] is not None or rewrite(account, True) is not None
+
+    # gain_loss rebooks gains postings whether or not the transaction is a sale
+    positions = prefilter.candidates(entries, is_gains_account, require_sale=False)
+    if positions:
+        entries = list(entries)
+    for i in positions:
+        entry = entries[i]
+        new_accounts.update(long_short.rebook_entry(entry, classify, rules))
+        entry, rewritten = gain_loss.rebook_entry(entry, rewrite)
+        entries[i] = entry
+        rewrite_count += len(rewritten)
+        new_accounts.update(rewritten)
+        used_accounts.update(posting.account for posting in entry.postings)
+
+    # Only open accounts that are still in use: gain_loss may have rebooked long_short's postings away
+    new_open_entries = common.create_open_directives(new_accounts & used_accounts, entries,
+                                                     meta_desc='<long_short_gain_loss>')
+    if DEBUG:
+        elapsed_time = time.time() - start_time
+        print("Long/short gain/loss classifier [{:.2f}s]: {} postings classified.".format(
+              elapsed_time, rewrite_count))
+    return new_open_entries + entries, errors
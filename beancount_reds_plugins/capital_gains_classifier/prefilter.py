@@ -0,0 +1,38 @@
+"""Cheap prefilter shared by the capital gains classifier plugins.
+
+Typically, well under 1% of a ledger's entries are sales. The plugins first find their candidate
+transactions with a single tight scan, and only look closely at those.
+"""
+
+from beancount.core import data
+
+
+def is_priced_reduction(posting):
+    """A lot reduction (sale) with a price. Without a price, gains can't be classified."""
+    return bool(posting.cost and posting.units.number and posting.price is not None)
+
+
+def candidates(entries, is_gains_account, require_sale=True):
+    """Return the indexes of transactions with a posting in a gains account and, if require_sale, a lot
+    reduction with a price.
+
+    Args:
+      entries: a list of entries
+      is_gains_account: function returning whether an account is a gains account. It is called once per
+        distinct account
+      require_sale: whether candidates must also contain a priced lot reduction
+    Returns:
+      A list of indexes into entries.
+    """
+    memo = {}
+
+    def gains(account):
+        result = memo.get(account)
+        if result is None:
+            result = memo[account] = bool(is_gains_account(account))
+        return result
+
+    return [i for i, entry in enumerate(entries)
+            if isinstance(entry, data.Transaction)
+            and any(gains(p.account) for p in entry.postings)
+            and (not require_sale or any(is_priced_reduction(p) for p in entry.postings))]
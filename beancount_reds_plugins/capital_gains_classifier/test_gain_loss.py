@@ -8,8 +8,6 @@ from beancount.parser import options
 from beancount import loader
 
 
-# TODO: test with multiple cases
-# "Income.*Capital-Gains:Short:.*: [":Short:", ":Short:Losses:", ":Short:Gains:"],
 config = """{
      "Income.*:Capital-Gains.*" : [":Capital-Gains",  ":Capital-Gains:Gains",  ":Capital-Gains:Losses"],
    }"""
@@ -68,3 +66,94 @@ class TestGainLoss(cmptest.TestCase):
           Income:Capital-Gains:Losses 50 USD
 
         """, new_entries)
+
+    @loader.load_doc()
+    def test_multiple_rules(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Capital-Gains:Short
+        2014-01-01 open Income:Capital-Gains:Long
+
+        2014-02-01 * "Buy"
+          Assets:Brokerage    300 ORNG {1 USD}
+          Assets:Bank        -300 USD
+
+        2014-03-01 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD} @ 1.50 USD
+          Assets:Bank         150 USD
+          Income:Capital-Gains:Short
+
+        2016-03-01 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD} @ 0.50 USD
+          Assets:Bank          50 USD
+          Income:Capital-Gains:Long
+
+        2016-03-02 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD} @ 1.50 USD
+          Assets:Bank         150 USD
+          Income:Capital-Gains:Long
+        """
+        multi_config = """{
+           'Income.*:Capital-Gains:Long.*':  [':Long',  ':Long:Gains',  ':Long:Losses'],
+           'Income.*:Capital-Gains:Short.*': [':Short', ':Short:Gains', ':Short:Losses'],
+           }"""
+        new_entries, _ = gain_loss(entries, options_map, multi_config)
+
+        self.assertEqualEntries("""
+        2014-01-01 open Assets:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Capital-Gains:Short
+        2014-01-01 open Income:Capital-Gains:Long
+        2014-01-01 open Income:Capital-Gains:Short:Gains
+        2014-01-01 open Income:Capital-Gains:Long:Gains
+        2014-01-01 open Income:Capital-Gains:Long:Losses
+
+        2014-02-01 * "Buy"
+          Assets:Brokerage    300 ORNG {1 USD}
+          Assets:Bank        -300 USD
+
+        2014-03-01 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD, 2014-02-01} @ 1.50 USD
+          Assets:Bank         150 USD
+          Income:Capital-Gains:Short:Gains -50 USD
+
+        2016-03-01 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD, 2014-02-01} @ 0.50 USD
+          Assets:Bank          50 USD
+          Income:Capital-Gains:Long:Losses 50 USD
+
+        2016-03-02 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD, 2014-02-01} @ 1.50 USD
+          Assets:Bank         150 USD
+          Income:Capital-Gains:Long:Gains -50 USD
+        """, new_entries)
+
+    @loader.load_doc()
+    def test_input_untouched(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Capital-Gains
+
+        2014-02-01 * "Buy"
+          Assets:Brokerage    200 ORNG {1 USD}
+          Assets:Bank        -200 USD
+
+        2016-03-01 * "Sell"
+          Income:Capital-Gains
+          Assets:Brokerage   -100 ORNG {1 USD} @ 1.50 USD
+          Assets:Bank         150 USD
+        """
+        original = list(entries)
+        original_postings = [list(e.postings) for e in entries if hasattr(e, 'postings')]
+        new_entries, _ = gain_loss(entries, options_map, config)
+
+        self.assertEqual(original, entries)
+        self.assertEqual(original_postings, [list(e.postings) for e in entries if hasattr(e, 'postings')])
+
+        # Postings keep their order, and untouched transactions are shared with the input
+        sale = new_entries[-1]
+        self.assertEqual(['Income:Capital-Gains:Gains', 'Assets:Brokerage', 'Assets:Bank'],
+                         [p.account for p in sale.postings])
+        self.assertIs(entries[-2], new_entries[-2])
@@ -1,7 +1,10 @@
 __copyright__ = "Copyright (C) 2021  Red S"
 __license__ = "GNU GPLv3"
 
-from beancount_reds_plugins.capital_gains_classifier.long_short import long_short
+import datetime
+
+from beancount_reds_plugins.capital_gains_classifier import long_short as long_short_module
+from beancount_reds_plugins.capital_gains_classifier.long_short import long_short, first_long_term_date
 from beancount.parser import options
 from beancount import loader
 from beancount.parser import cmptest
@@ -21,6 +24,12 @@ class TestLongShort(cmptest.TestCase):
         entries, _ = long_short([], options.OPTIONS_DEFAULTS.copy(), config)
         self.assertEqual([], entries)
 
+    def test_first_long_term_date(self):
+        # IRS example: bought Feb 5, 2008; Feb 5, 2009 is short term, Feb 6, 2009 is long term
+        self.assertEqual(datetime.date(2009, 2, 6), first_long_term_date(datetime.date(2008, 2, 5)))
+        self.assertEqual(datetime.date(2017, 3, 1), first_long_term_date(datetime.date(2016, 2, 29)))
+        self.assertEqual(datetime.date(2017, 1, 1), first_long_term_date(datetime.date(2015, 12, 31)))
+
     @loader.load_doc()
     def test_do_not_touch(self, entries, _, options_map):
         """
@@ -345,3 +354,100 @@ class TestLongShort(cmptest.TestCase):
           Income:Capital-Gains  -50 USD
 
         """, new_entries)
+
+    @loader.load_doc()
+    def test_multiple_rules(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Taxable:Brokerage
+        2014-01-01 open Assets:Trust:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Taxable:Capital-Gains
+        2014-01-01 open Income:Trust:Capital-Gains
+
+        2014-02-01 * "Buy"
+          Assets:Taxable:Brokerage    100 ORNG {1 USD}
+          Assets:Trust:Brokerage      100 ORNG {1 USD}
+          Assets:Bank                -200 USD
+
+        2014-03-01 * "Sell taxable"
+          Assets:Taxable:Brokerage   -100 ORNG {1 USD} @ 1.50 USD
+          Assets:Bank                 150 USD
+          Income:Taxable:Capital-Gains
+
+        2016-03-01 * "Sell trust"
+          Assets:Trust:Brokerage     -100 ORNG {1 USD} @ 1.50 USD
+          Assets:Bank                 150 USD
+          Income:Trust:Capital-Gains
+        """
+        multi_config = """{
+           'Income:Taxable:Capital-Gains': [':Capital-Gains', ':Capital-Gains:Short', ':Capital-Gains:Long'],
+           'Income:Trust:Capital-Gains': [':Capital-Gains', ':Capital-Gains:ST', ':Capital-Gains:LT'],
+           }"""
+        new_entries, _ = long_short(entries, options_map, multi_config)
+
+        self.assertEqualEntries("""
+        2014-01-01 open Assets:Taxable:Brokerage
+        2014-01-01 open Assets:Trust:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Taxable:Capital-Gains
+        2014-01-01 open Income:Trust:Capital-Gains
+        2014-01-01 open Income:Taxable:Capital-Gains:Short
+        2014-01-01 open Income:Trust:Capital-Gains:LT
+
+        2014-02-01 * "Buy"
+          Assets:Taxable:Brokerage    100 ORNG {1 USD}
+          Assets:Trust:Brokerage      100 ORNG {1 USD}
+          Assets:Bank                -200 USD
+
+        2014-03-01 * "Sell taxable"
+          Assets:Taxable:Brokerage   -100 ORNG {1 USD} @ 1.50 USD
+          Assets:Bank                 150 USD
+          Income:Taxable:Capital-Gains:Short -50.00 USD
+
+        2016-03-01 * "Sell trust"
+          Assets:Trust:Brokerage     -100 ORNG {1 USD} @ 1.50 USD
+          Assets:Bank                 150 USD
+          Income:Trust:Capital-Gains:LT -50.00 USD
+        """, new_entries)
+
+    def test_uncombinable_rules(self):
+        # Inline flags and backreferences can't be combined into one regexp: rules are matched in order
+        match_rule, rules = long_short_module.compile_rules({
+            '(?i)income.*:capital-gains': [':Capital-Gains', ':Capital-Gains:Short', ':Capital-Gains:Long'],
+            'Income:(\\w+):\\1:Capital-Gains': [':Capital-Gains', ':Capital-Gains:ST', ':Capital-Gains:LT'],
+        })
+        self.assertEqual('_rule0', match_rule('Income:Taxable:Capital-Gains'))
+        self.assertIsNone(match_rule('Expenses:Foo'))
+
+        match_rule, _ = long_short_module.compile_rules({
+            'Income:(\\w+):\\1:Capital-Gains': [':Capital-Gains', ':Capital-Gains:ST', ':Capital-Gains:LT'],
+            'Income:.*:Capital-Gains': [':Capital-Gains', ':Capital-Gains:Short', ':Capital-Gains:Long'],
+        })
+        self.assertEqual('_rule0', match_rule('Income:Trust:Trust:Capital-Gains'))
+        self.assertEqual('_rule1', match_rule('Income:Trust:Taxable:Capital-Gains'))
+
+    @loader.load_doc()
+    def test_inline_flags(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Capital-Gains
+
+        2014-02-01 * "Buy"
+          Assets:Brokerage    100 ORNG {1 USD}
+          Assets:Bank        -100 USD
+
+        2014-03-01 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD} @ 1.50 USD
+          Assets:Bank         150 USD
+          Income:Capital-Gains
+        """
+        flags_config = "{'(?i)income.*:capital-gains': [':Capital-Gains', ':Capital-Gains:Short', ':Capital-Gains:Long']}"
+        new_entries, errors = long_short(entries, options_map, flags_config)
+        self.assertEqual([], errors)
+        self.assertEqual(['Income:Capital-Gains:Short'], [p.account for p in new_entries[-1].postings
+                                                          if 'Capital-Gains' in p.account])
+
+        new_entries, errors = long_short(entries, options_map, "{'Income:(': ['a', 'b', 'c']}")
+        self.assertEqual(1, len(errors))
+        self.assertIs(entries, new_entries)
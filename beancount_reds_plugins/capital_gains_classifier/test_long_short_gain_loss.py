@@ -0,0 +1,104 @@
+__copyright__ = "Copyright (C) 2021  Red S"
+__license__ = "GNU GPLv3"
+
+import copy
+
+from beancount_reds_plugins.capital_gains_classifier.gain_loss import gain_loss
+from beancount_reds_plugins.capital_gains_classifier.long_short import long_short
+from beancount_reds_plugins.capital_gains_classifier.long_short_gain_loss import long_short_gain_loss
+from beancount.core import data
+from beancount.parser import options
+from beancount import loader
+from beancount.parser import cmptest
+
+long_short_config = """{
+   'Income.*:Capital-Gains': [':Capital-Gains', ':Capital-Gains:Short', ':Capital-Gains:Long']
+   }"""
+
+gain_loss_config = """{
+   'Income.*:Capital-Gains:Long.*':  [':Long',  ':Long:Gains',  ':Long:Losses'],
+   'Income.*:Capital-Gains:Short.*': [':Short', ':Short:Gains', ':Short:Losses'],
+   }"""
+
+config = "{{'long_short': {}, 'gain_loss': {}}}".format(long_short_config, gain_loss_config)
+
+
+class TestLongShortGainLoss(cmptest.TestCase):
+    def test_empty_entries(self):
+        entries, _ = long_short_gain_loss([], options.OPTIONS_DEFAULTS.copy(), config)
+        self.assertEqual([], entries)
+
+    @loader.load_doc()
+    def test_four_way(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Capital-Gains
+
+        2014-02-01 * "Buy"
+          Assets:Brokerage    100 ORNG {1 USD}
+          Assets:Bank        -100 USD
+
+        2016-02-01 * "Buy"
+          Assets:Brokerage    100 ORNG {2 USD}
+          Assets:Bank        -200 USD
+
+        2016-03-01 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD} @ 1.75 USD
+          Assets:Brokerage   -100 ORNG {2 USD} @ 1.75 USD
+          Assets:Bank         350 USD
+          Income:Capital-Gains
+        """
+        new_entries, _ = long_short_gain_loss(entries, options_map, config)
+
+        self.assertEqualEntries("""
+        2014-01-01 open Assets:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Capital-Gains
+        2014-01-01 open Income:Capital-Gains:Long:Gains
+        2014-01-01 open Income:Capital-Gains:Short:Losses
+
+        2014-02-01 * "Buy"
+          Assets:Brokerage    100 ORNG {1 USD}
+          Assets:Bank        -100 USD
+
+        2016-02-01 * "Buy"
+          Assets:Brokerage    100 ORNG {2 USD}
+          Assets:Bank        -200 USD
+
+        2016-03-01 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD} @ 1.75 USD
+          Assets:Brokerage   -100 ORNG {2 USD} @ 1.75 USD
+          Assets:Bank         350 USD
+          Income:Capital-Gains:Short:Losses   25.000 USD
+          Income:Capital-Gains:Long:Gains    -75.000 USD
+        """, new_entries)
+
+    @loader.load_doc()
+    def test_same_as_sequential(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Capital-Gains
+
+        2014-02-01 * "Buy"
+          Assets:Brokerage    300 ORNG {1 USD}
+          Assets:Bank        -300 USD
+
+        2014-03-01 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD} @ 1.50 USD
+          Assets:Bank         150 USD
+          Income:Capital-Gains
+
+        2016-03-01 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD} @ 0.50 USD
+          Assets:Bank          50 USD
+          Income:Capital-Gains
+        """
+        combined, _ = long_short_gain_loss(copy.deepcopy(entries), options_map, config)
+        sequential, _ = long_short(entries, options_map, long_short_config)
+        sequential, _ = gain_loss(sequential, options_map, gain_loss_config)
+
+        def transactions(entries):
+            return [e for e in entries if isinstance(e, data.Transaction)]
+        self.assertEqualEntries(transactions(sequential), transactions(combined))
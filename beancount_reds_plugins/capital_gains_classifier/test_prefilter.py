@@ -0,0 +1,50 @@
+__copyright__ = "Copyright (C) 2021  Red S"
+__license__ = "GNU GPLv3"
+
+import unittest
+
+from beancount_reds_plugins.capital_gains_classifier import prefilter
+from beancount import loader
+
+
+def is_gains_account(account):
+    return account.startswith('Income:Capital-Gains')
+
+
+class TestPrefilter(unittest.TestCase):
+
+    @loader.load_doc()
+    def test_candidates(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Capital-Gains
+        2014-01-01 open Income:Dividends
+
+        2014-02-01 * "Buy"
+          Assets:Brokerage    200 ORNG {1 USD}
+          Assets:Bank        -200 USD
+
+        2014-03-01 * "Sell"
+          Assets:Brokerage   -100 ORNG {1 USD} @ 1.50 USD
+          Assets:Bank         150 USD
+          Income:Capital-Gains
+
+        2014-03-02 * "Sell without gains"
+          Assets:Brokerage   -50 ORNG {1 USD} @ 1.50 USD
+          Assets:Bank         75 USD
+          Income:Dividends
+
+        2014-03-03 * "Broker reported gains"
+          Assets:Bank          10 USD
+          Income:Capital-Gains
+        """
+        narrations = [entries[i].narration for i in prefilter.candidates(entries, is_gains_account)]
+        self.assertEqual(["Sell"], narrations)
+
+        narrations = [entries[i].narration
+                      for i in prefilter.candidates(entries, is_gains_account, require_sale=False)]
+        self.assertEqual(["Sell", "Broker reported gains"], narrations)
+
+    def test_empty_entries(self):
+        self.assertEqual([], prefilter.candidates([], is_gains_account))
@@ -0,0 +1,133 @@
+__copyright__ = "Copyright (C) 2021  Red S"
+__license__ = "GNU GPLv3"
+
+import datetime
+import unittest
+
+from beancount_reds_plugins.capital_gains_classifier.wash_sale import wash_sale
+from beancount_reds_plugins.capital_gains_classifier import wash_sale as ws
+from beancount.parser import options
+from beancount import loader
+
+
+def flags(entries, meta_key='wash_sale'):
+    return [(entry.date, posting.meta[meta_key])
+            for entry in entries if hasattr(entry, 'postings')
+            for posting in entry.postings if posting.meta and meta_key in posting.meta]
+
+
+class TestWashSale(unittest.TestCase):
+
+    def test_empty_entries(self):
+        entries, errors = wash_sale([], options.OPTIONS_DEFAULTS.copy())
+        self.assertEqual([], entries)
+        self.assertEqual([], errors)
+
+    @loader.load_doc()
+    def test_basic(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Capital-Gains
+
+        2014-01-01 * "Buy"
+          Assets:Brokerage    300 ORNG {10 USD}
+          Assets:Bank        -3000 USD
+
+        2014-02-15 * "Sell at a loss, no replacement"
+          Assets:Brokerage   -100 ORNG {10 USD} @ 8 USD
+          Assets:Bank         800 USD
+          Income:Capital-Gains
+
+        2014-04-01 * "Sell at a loss, replaced later"
+          Assets:Brokerage   -100 ORNG {10 USD} @ 8 USD
+          Assets:Bank         800 USD
+          Income:Capital-Gains
+
+        2014-04-20 * "Buy"
+          Assets:Brokerage    100 ORNG {9 USD}
+          Assets:Bank        -900 USD
+
+        2014-05-01 * "Sell at a gain"
+          Assets:Brokerage   -100 ORNG {10 USD} @ 12 USD
+          Assets:Bank        1200 USD
+          Income:Capital-Gains
+        """
+        new_entries, errors = wash_sale(entries, options_map)
+        self.assertEqual([], errors)
+        self.assertEqual([(datetime.date(2014, 4, 1), datetime.date(2014, 4, 20))], flags(new_entries))
+
+        # The input is left untouched
+        self.assertEqual([], flags(entries))
+
+    @loader.load_doc()
+    def test_own_lot_and_window(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Brokerage
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Capital-Gains
+
+        2014-03-01 * "Buy"
+          Assets:Brokerage    100 ORNG {10 USD}
+          Assets:Bank        -1000 USD
+
+        2014-03-10 * "Buy"
+          Assets:Brokerage    100 ORNG {11 USD}
+          Assets:Bank        -1100 USD
+
+        2014-03-15 * "Sell the first lot at a loss, the second was bought within the window"
+          Assets:Brokerage   -100 ORNG {10 USD} @ 9 USD
+          Assets:Bank         900 USD
+          Income:Capital-Gains
+
+        2014-05-01 * "Sell the second lot at a loss, its own acquisition doesn't count"
+          Assets:Brokerage   -100 ORNG {11 USD} @ 9 USD
+          Assets:Bank         900 USD
+          Income:Capital-Gains
+        """
+        new_entries, errors = wash_sale(entries, options_map, "{'warn': True, 'meta_key': 'wash'}")
+        self.assertEqual([(datetime.date(2014, 3, 15), datetime.date(2014, 3, 10))], flags(new_entries, 'wash'))
+        self.assertEqual(1, len(errors))
+
+        # The first lot's own acquisition, 14 days before its sale, is no replacement
+        new_entries, errors = wash_sale(entries, options_map, "{'window_days': 3}")
+        self.assertEqual([], flags(new_entries))
+
+    @loader.load_doc()
+    def test_short_cover(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Brokerage
+        2014-01-01 open Assets:Short
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Income:Capital-Gains
+
+        2014-01-01 * "Buy"
+          Assets:Brokerage    100 ORNG {10 USD}
+          Assets:Bank        -1000 USD
+
+        2014-03-01 * "Sell short"
+          Assets:Short        -50 ORNG {9 USD}
+          Assets:Bank         450 USD
+
+        2014-04-01 * "Sell at a loss"
+          Assets:Brokerage   -100 ORNG {10 USD} @ 8 USD
+          Assets:Bank         800 USD
+          Income:Capital-Gains
+
+        2014-04-10 * "Buy to cover: not a replacement"
+          Assets:Short         50 ORNG {9 USD} @ 7 USD
+          Assets:Bank        -350 USD
+          Income:Capital-Gains
+        """
+        new_entries, errors = wash_sale(entries, options_map)
+        self.assertEqual([], errors)
+        self.assertEqual([], flags(new_entries))
+
+    def test_replacement_date(self):
+        d = datetime.date
+        acquisitions = ([d(2014, 1, 1), d(2014, 2, 1), d(2014, 3, 1)],
+                        [(d(2014, 1, 1), 1), (d(2014, 2, 1), 2), (d(2014, 3, 1), 3)])
+        window = datetime.timedelta(days=30)
+        self.assertEqual(d(2014, 2, 1), ws.replacement_date(acquisitions, d(2014, 2, 15), (d(2014, 1, 1), 1), window))
+        self.assertEqual(d(2014, 3, 1), ws.replacement_date(acquisitions, d(2014, 2, 15), (d(2014, 2, 1), 2), window))
+        self.assertIsNone(ws.replacement_date(acquisitions, d(2014, 5, 1), (d(2014, 1, 1), 1), window))
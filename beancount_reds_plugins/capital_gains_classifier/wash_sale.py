@@ -0,0 +1,154 @@
+"""Flags potential wash sales: sales at a loss with an acquisition of the same commodity within 30 days
+before or after the sale (per IRS, US).
+
+Invoke it in your beancount source this way:
+plugin "beancount_reds_plugins.capital_gains_classifier.wash_sale"
+
+or with a config (all keys optional, defaults shown):
+plugin "beancount_reds_plugins.capital_gains_classifier.wash_sale" "{
+    'window_days': 30,
+    'meta_key': 'wash_sale',
+    'warn': False,
+    }"
+
+Each flagged sale posting gets a meta_key metadata entry set to the date of a replacement acquisition.
+With 'warn': True, an error (warning) is also reported for each one. The acquisition of the lot being
+sold doesn't count as a replacement, and neither does buying to cover a short position.
+
+This only flags potential wash sales. It doesn't adjust cost bases or holding periods: whether a sale is
+a wash sale, and how much of the loss is disallowed, depends on the quantities involved and on
+acquisitions in other accounts.
+"""
+
+import bisect
+import collections
+import datetime
+import time
+
+from ast import literal_eval
+from beancount.core import data
+from beancount_reds_plugins.capital_gains_classifier import prefilter
+
+DEBUG = 0
+__plugins__ = ('wash_sale',)
+
+WashSaleError = collections.namedtuple('WashSaleError', 'source message entry')
+
+DEFAULT_CONFIG = {
+    'window_days': 30,
+    'meta_key': 'wash_sale',
+    'warn': False,
+}
+
+
+def is_loss_sale(posting):
+    return (prefilter.is_priced_reduction(posting) and posting.units.number < 0
+            and posting.price.number < posting.cost.number)
+
+
+def is_acquisition(posting, held):
+    """Whether posting acquires units, given the units of its commodity held at cost in its account before it.
+    Buying to cover a short position is not an acquisition, except for any units bought beyond the short."""
+    return (posting.cost is not None and posting.units.number is not None and posting.units.number > 0
+            and held + posting.units.number > 0)
+
+
+def build_index(entries):
+    """Index the acquisitions of each commodity, and find the loss sales, in a single traversal.
+
+    Args:
+      entries: a list of entries, sorted by date
+    Returns:
+      A tuple of:
+        a dict mapping each commodity to a tuple of (sorted list of acquisition dates, list of the
+          (date, cost number) of each acquired lot, in the same order)
+        a list of (entry index, posting index) of loss sales
+    """
+    acquisitions = {}
+    loss_sales = []
+    held = {}  # (account, commodity) -> units held at cost, to tell acquisitions from short covers
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, data.Transaction):
+            continue
+        for j, posting in enumerate(entry.postings):
+            key = (posting.account, posting.units.currency)
+            if is_acquisition(posting, held.get(key, 0)):
+                dates, lots = acquisitions.setdefault(posting.units.currency, ([], []))
+                dates.append(entry.date)
+                lots.append((posting.cost.date or entry.date, posting.cost.number))
+            elif is_loss_sale(posting):
+                loss_sales.append((i, j))
+            if posting.cost is not None and posting.units.number is not None:
+                held[key] = held.get(key, 0) + posting.units.number
+    return acquisitions, loss_sales
+
+
+def replacement_date(acquisitions, sale_date, lot, window):
+    """Return the date of the earliest acquisition within window of sale_date, other than lot, or None.
+
+    Args:
+      acquisitions: a (dates, lots) tuple for a commodity, as built by build_index()
+      sale_date: the date of the sale
+      lot: the (date, cost number) of the lot sold
+      window: a datetime.timedelta
+    """
+    dates, lots = acquisitions
+    lo = bisect.bisect_left(dates, sale_date - window)
+    hi = bisect.bisect_right(dates, sale_date + window)
+    for k in range(lo, hi):
+        if lots[k] != lot:
+            return dates[k]
+    return None
+
+
+def flag_entry(entry, flags, meta_key):
+    """Return a copy of entry with the postings in flags (a dict of posting index -> replacement date)
+    flagged in their metadata."""
+    postings = list(entry.postings)
+    for j, date in flags.items():
+        meta = dict(postings[j].meta or {})
+        meta[meta_key] = date
+        postings[j] = postings[j]._replace(meta=meta)
+    return entry._replace(postings=postings)
+
+
+def wash_sale(entries, options_map, config=None):
+    """Flag sales at a loss with a replacement acquisition of the same commodity within the window."""
+
+    start_time = time.time()
+    errors = []
+    config_obj = dict(DEFAULT_CONFIG)
+    if config:
+        config_obj.update(literal_eval(config))
+    window = datetime.timedelta(days=config_obj['window_days'])
+
+    acquisitions, loss_sales = build_index(entries)
+
+    flagged = collections.defaultdict(dict)
+    for i, j in loss_sales:
+        entry = entries[i]
+        posting = entry.postings[j]
+        commodity = posting.units.currency
+        if commodity not in acquisitions:
+            continue
+        lot = (posting.cost.date, posting.cost.number)
+        date = replacement_date(acquisitions[commodity], entry.date, lot, window)
+        if date is None:
+            continue
+        flagged[i][j] = date
+        if config_obj['warn']:
+            errors.append(WashSaleError(
+                entry.meta, "wash_sale: loss sale of {} in {} with a replacement acquired on {}".format(
+                    commodity, posting.account, date), entry))
+
+    # Only the flagged transactions are replaced, in a copy of the list. The rest are shared with the input
+    if flagged:
+        entries = list(entries)
+    for i, flags in flagged.items():
+        entries[i] = flag_entry(entries[i], flags, config_obj['meta_key'])
+
+    if DEBUG:
+        elapsed_time = time.time() - start_time
+        print("Wash sale detector [{:.2f}s]: {} loss sales, {} flagged.".format(
+              elapsed_time, len(loss_sales), sum(len(flags) for flags in flagged.values())))
+    return entries, errors
@@ -0,0 +1,65 @@
+"""Helpers shared by the plugins' benchmark scripts. Results are emitted as JSON lines, one per
+measurement, so runs can be diffed or collected to spot regressions."""
+
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+
+
+def measure(name, func, setup=None, repeat=5, **params):
+    """Time func, and trace its peak memory usage in one extra (slower) run.
+
+    Args:
+      name: name of the measurement
+      func: callable to measure. Called with the result of setup() if setup is given, else with no args
+      setup: optional callable, run before each call of func and excluded from measurements. Use this
+        for plugins that modify their input in place
+      repeat: number of timed runs
+      params: extra fields to include in the result, typically the parameters of the synthetic input
+    Returns:
+      A dict of results.
+    """
+    def run():
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start
+
+    times = [run() for _ in range(repeat)]
+    args = () if setup is None else (setup(),)
+    tracemalloc.start()
+    try:
+        # setup() ran before tracing started, so only memory allocated by func counts
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'name': name, **params, 'repeat': repeat,
+            'min_s': min(times), 'median_s': statistics.median(times), 'peak_bytes': peak}
+
+
+def percentiles(name, samples, points=(50, 90, 99), **params):
+    """Summarize per-item latencies (eg: per sale) with nearest-rank percentiles.
+
+    Args:
+      name: name of the measurement
+      samples: a list of durations, in seconds
+      points: the percentiles to report
+      params: extra fields to include in the result
+    Returns:
+      A dict of results.
+    """
+    ordered = sorted(samples)
+    result = {'name': name, **params, 'count': len(ordered)}
+    for point in points:
+        rank = max(1, -(-point * len(ordered) // 100))  # ceil
+        result['p{}_s'.format(point)] = ordered[rank - 1] if ordered else None
+    result['max_s'] = ordered[-1] if ordered else None
+    return result
+
+
+def report(results, file=sys.stdout):
+    for result in results:
+        print(json.dumps(result, sort_keys=True, default=str), file=file)
@@ -0,0 +1,124 @@
+"""Benchmarks for effective_date and effective_date_transaction on synthetic ledgers.
+
+Run with:
+    python -m beancount_reds_plugins.effective_date.benchmark_effective_date --entries 100000 --fraction 0.01
+
+Prints one JSON line per measurement: the plugins end to end, and the pieces most likely to regress
+(metadata deepcopy, link generation and output assembly).
+"""
+
+import argparse
+import datetime
+import random
+
+from beancount.core import data
+from beancount.core.amount import Amount
+from beancount.core.number import D
+from beancount_reds_plugins.common import benchmark
+from beancount_reds_plugins.effective_date import effective_date as ed
+
+
+def holding_config(depth):
+    """Config string with a holding account rule at each level of Expenses:L0:L1:...:L<depth-1>."""
+    holds = {'Expenses': {'earlier': 'Liabilities:Hold:Expenses', 'later': 'Assets:Hold:Expenses'},
+             'Income': {'earlier': 'Assets:Hold:Income', 'later': 'Liabilities:Hold:Income'}}
+    prefix = 'Expenses'
+    for level in range(depth):
+        prefix += ':L{}'.format(level)
+        holds[prefix] = {'earlier': 'Liabilities:Hold:{}'.format(level), 'later': 'Assets:Hold:{}'.format(level)}
+    return repr(holds)
+
+
+def generate_ledger(num_entries, fraction, meta_size=0, depth=0, spread_fraction=0.0,
+                    transaction_level=False, num_accounts=50, seed=1):
+    """Generate a ledger of two-posting expense transactions, ten per day.
+
+    Args:
+      num_entries: number of transactions
+      fraction: fraction of transactions carrying an effective date
+      meta_size: number of extra metadata keys on each posting (and entry), which effective_date copies
+      depth: depth of the expense accounts below Expenses, matching holding_config(depth)
+      spread_fraction: fraction of the effective dated postings using a monthly effective_date_range
+        instead of an effective_date
+      transaction_level: put effective_date on the transaction, for effective_date_transaction
+      num_accounts: number of distinct expense accounts
+      seed: random seed, so runs are comparable
+    Returns:
+      A list of entries, starting with the Open directives.
+    """
+    rng = random.Random(seed)
+    parent = ':'.join(['Expenses'] + ['L{}'.format(level) for level in range(depth)])
+    accounts = ['{}:Leaf{}'.format(parent, i) for i in range(num_accounts)]
+    start = datetime.date(2000, 1, 1)
+
+    def meta(lineno):
+        m = data.new_metadata('<benchmark>', lineno)
+        m.update({'key{}'.format(k): 'value{}'.format(k) for k in range(meta_size)})
+        return m
+
+    entries = [data.Open(meta(0), start, account, None, None) for account in accounts + ['Liabilities:Card']]
+    for i in range(num_entries):
+        date = start + datetime.timedelta(days=i // 10)
+        number = D(rng.randrange(100, 100000)) / 100
+        entry_meta = meta(i)
+        posting_meta = meta(i)
+        if rng.random() < fraction:
+            effective = date + datetime.timedelta(days=rng.randrange(-60, 60))
+            if transaction_level:
+                entry_meta['effective_date'] = effective
+            elif rng.random() < spread_fraction:
+                posting_meta[ed.RANGE_KEY] = '{}..{}'.format(date, date + datetime.timedelta(days=364))
+            else:
+                posting_meta['effective_date'] = effective
+        postings = [data.Posting('Liabilities:Card', Amount(-number, 'USD'), None, None, None, meta(i)),
+                    data.Posting(rng.choice(accounts), Amount(number, 'USD'), None, None, None, posting_meta)]
+        entries.append(data.Transaction(entry_meta, date, '*', None, 'Txn {}'.format(i),
+                                        data.EMPTY_SET, data.EMPTY_SET, postings))
+    return entries
+
+
+def run(num_entries, fraction, meta_size, depth, spread_fraction, repeat):
+    params = dict(entries=num_entries, fraction=fraction, meta_size=meta_size, depth=depth,
+                  spread_fraction=spread_fraction)
+    config = holding_config(depth)
+    posting_level = generate_ledger(num_entries, fraction, meta_size, depth, spread_fraction)
+    transaction_level = generate_ledger(num_entries, fraction, meta_size, depth, transaction_level=True)
+    positions = [i for i, e in enumerate(posting_level)
+                 if isinstance(e, data.Transaction) and ed.has_posting_with_valid_effective_date(e)]
+    interesting = [posting_level[i] for i in positions]
+    postings = [p for e in interesting for p in e.postings]
+
+    return [
+        benchmark.measure('effective_date', lambda: ed.effective_date(posting_level, {}, config),
+                          repeat=repeat, **params),
+        benchmark.measure('effective_date_transaction',
+                          lambda: ed.effective_date_transaction(transaction_level, {}, config),
+                          repeat=repeat, **params),
+        benchmark.measure('deepcopy_meta', lambda: [ed.cleaned(p) for p in postings],
+                          repeat=repeat, **params),
+        benchmark.measure('make_link', lambda: [ed.make_link(e) for e in interesting],
+                          repeat=repeat, **params),
+        benchmark.measure('splice', lambda: ed.splice(posting_level, positions, lambda entry, out: out.append(entry)),
+                          repeat=repeat, **params),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--entries', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--fraction', type=float, nargs='+', default=[0.001, 0.01, 0.1])
+    parser.add_argument('--meta-size', type=int, nargs='+', default=[0, 10])
+    parser.add_argument('--depth', type=int, nargs='+', default=[0, 4])
+    parser.add_argument('--spread-fraction', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for num_entries in args.entries:
+        for fraction in args.fraction:
+            for meta_size in args.meta_size:
+                for depth in args.depth:
+                    benchmark.report(run(num_entries, fraction, meta_size, depth, args.spread_fraction, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
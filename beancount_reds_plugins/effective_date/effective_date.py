@@ -1,12 +1,16 @@
 """Beancount plugin to implement per-posting effective dates. See README.md for more."""
 
 from ast import literal_eval
+import calendar
+import collections
 import copy
 import datetime
+import functools
 import random
 import string
 import sys
 import time
+from decimal import Decimal, ROUND_DOWN
 from beancount.core import data
 from beancount_reds_plugins.common import common
 
@@ -17,6 +21,21 @@ __plugins__ = ['effective_date']
 # __plugins__ = ['effective_date', 'effective_date_transaction']
 
 LINK_FORMAT = 'edate-{date}-{random}'
+RANGE_KEY = 'effective_date_range'
+PERIOD_KEY = 'effective_date_period'
+DEFAULT_PERIOD = 'monthly'
+EFFECTIVE_DATE_KEYS = ('effective_date', RANGE_KEY, PERIOD_KEY)
+
+# period -> (months, days) to step by between consecutive slices of a spread
+PERIODS = {
+        'daily':     (0, 1),
+        'weekly':    (0, 7),
+        'monthly':   (1, 0),
+        'quarterly': (3, 0),
+        'yearly':    (12, 0),
+        }
+
+EffectiveDateError = collections.namedtuple('EffectiveDateError', 'source message entry')
 
 
 def has_valid_effective_date(posting):
@@ -25,40 +44,264 @@ def has_valid_effective_date(posting):
              type(posting.meta['effective_date']) is datetime.date
 
 
+def has_effective_date_range(posting):
+    return posting.meta is not None and \
+             type(posting.meta.get(RANGE_KEY)) is str
+
+
 def has_posting_with_valid_effective_date(entry):
     for posting in entry.postings:
-        if has_valid_effective_date(posting):
+        if has_valid_effective_date(posting) or has_effective_date_range(posting):
             return True
     return False
 
 
-def create_new_effective_date_entry(entry, date, hold_posting, original_posting):
-    def cleaned(p):
-        clean_meta = copy.deepcopy(p.meta)
-        clean_meta.pop('effective_date', None)
-        return p._replace(meta=clean_meta)
+@functools.lru_cache(maxsize=1024)
+def parse_date_range(date_range):
+    """Parse 'YYYY-MM-DD..YYYY-MM-DD' into a (start, end) pair of dates. Raises ValueError."""
+    start, sep, end = date_range.partition('..')
+    if not sep:
+        raise ValueError("expected 'start..end', got '{}'".format(date_range))
+    start = datetime.date.fromisoformat(start.strip())
+    end = datetime.date.fromisoformat(end.strip())
+    if end < start:
+        raise ValueError("range ends before it starts: '{}'".format(date_range))
+    return start, end
+
+
+def add_months(date, months):
+    """Add months to date, clamping the day to the end of the resulting month."""
+    year, month = divmod(date.month - 1 + months, 12)
+    year += date.year
+    day = min(date.day, calendar.monthrange(year, month + 1)[1])
+    return datetime.date(year, month + 1, day)
+
+
+@functools.lru_cache(maxsize=1024)
+def spread_calendar(start, end, period):
+    """Dates of each slice of a spread: start, then every period after it, up to and including end.
+
+    Steps are anchored to start (Jan 31 monthly gives Feb 29, Mar 31, ...), and cached since the same
+    range is typically used by many postings."""
+    try:
+        months, days = PERIODS[period]
+    except KeyError:
+        raise ValueError("unknown {} '{}'. Use one of: {}".format(PERIOD_KEY, period, ', '.join(PERIODS)))
+    dates = []
+    step = 0
+    date = start
+    while date <= end:
+        dates.append(date)
+        step += 1
+        date = add_months(start, months * step) + datetime.timedelta(days=days * step)
+    return tuple(dates)
+
+
+def spread(number, dates):
+    """Yield a (date, number) pair per date, splitting number evenly across dates.
+
+    Slices are rounded to the precision of number, or to cents if that is coarser. The remainder is
+    distributed one unit of that precision at a time over the leading slices, so the slices always sum
+    to number exactly."""
+    if len(dates) == 1:
+        yield dates[0], number
+        return
+    quantum = Decimal(1).scaleb(min(number.as_tuple().exponent, -2))
+    share = (number / len(dates)).quantize(quantum, rounding=ROUND_DOWN)
+    leftover = int((number - share * len(dates)) / quantum)
+    extra = quantum if leftover > 0 else -quantum
+    for i, date in enumerate(dates):
+        yield date, (share + extra if i < abs(leftover) else share)
+
+
+def posting_calendar(posting):
+    """Dates a posting is to be booked on. Raises ValueError for a malformed range or period."""
+    if has_valid_effective_date(posting):
+        return (posting.meta['effective_date'],)
+    start, end = parse_date_range(posting.meta[RANGE_KEY])
+    return spread_calendar(start, end, posting.meta.get(PERIOD_KEY, DEFAULT_PERIOD))
+
+
+def cleaned(p):
+    clean_meta = copy.deepcopy(p.meta)
+    for key in EFFECTIVE_DATE_KEYS:
+        clean_meta.pop(key, None)
+    return p._replace(meta=clean_meta)
+
 
+def create_new_effective_date_entry(entry, date, hold_posting, original_posting):
+    """Create the entry at the effective date. Expects postings already stripped of effective date
+    metadata (see cleaned())."""
     new_meta = {'original_date': entry.date}
     effective_date_entry = entry._replace(date=date, meta={**entry.meta, **new_meta},
-                                          postings=[cleaned(hold_posting), cleaned(original_posting)])
+                                          postings=[hold_posting, original_posting])
     return effective_date_entry
 
 
-def build_config(config):
+DEFAULT_HOLDING_ACCTS = {
+        'Expenses': {'earlier': 'Liabilities:Hold:Expenses', 'later': 'Assets:Hold:Expenses'},
+        'Income':   {'earlier': 'Assets:Hold:Income', 'later': 'Liabilities:Hold:Income'},
+        }
+
+# effective_date_transaction has always used these, and ignored its config
+LEGACY_HOLDING_ACCTS = {
+        'Expenses': {'earlier': 'Liabilities:Hold', 'later': 'Assets:Hold'},
+        'Income':   {'earlier': 'Assets:Hold', 'later': 'Liabilities:Hold'},
+        }
+
+
+def build_config(config, default=DEFAULT_HOLDING_ACCTS):
     holding_accts = {}
     if config:
         holding_accts = literal_eval(config)
     if not holding_accts:
         if DEBUG:
             print("effective_date: Using default config", file=sys.stderr)
-        holding_accts = {
-                'Expenses': {'earlier': 'Liabilities:Hold:Expenses', 'later': 'Assets:Hold:Expenses'},
-                'Income':   {'earlier': 'Assets:Hold:Income', 'later': 'Liabilities:Hold:Income'},
-                }
+        holding_accts = default
     return holding_accts
 
 
-def effective_date(entries, options_map, config):
+def compile_config(holding_accts):
+    """Compile the holding account config into a resolver for posting accounts.
+
+    Returns a function mapping an account to the (prefix, {'earlier': ..., 'later': ...}) entry of
+    holding_accts for its longest matching prefix (compared by account component), or None. Prefixes are
+    looked up in a trie of account components, and results are memoized per account, since the same few
+    accounts carry effective dates over and over."""
+    trie = {}
+    for prefix, holds in holding_accts.items():
+        node = trie
+        for component in prefix.split(':'):
+            node = node.setdefault(component, {})
+        node[None] = (prefix, holds)
+
+    memo = {}
+
+    def resolve(account):
+        try:
+            return memo[account]
+        except KeyError:
+            pass
+        found = None
+        node = trie
+        for component in account.split(':'):
+            node = node.get(component)
+            if node is None:
+                break
+            found = node.get(None, found)
+        memo[account] = found
+        return found
+    return resolve
+
+
+def make_link(entry):
+    """A human readable link for a set of effective date entries, eg: edate-141215-xlu"""
+    rand_string = ''.join(random.choice(string.ascii_lowercase) for i in range(3))
+    date = str(entry.date).replace('-', '')[2:]
+    return LINK_FORMAT.format(date=date, random=rand_string)
+
+
+def holding_posting(posting, resolve, later):
+    """Return posting moved to its holding account, or None if its account has no holding account."""
+    found = resolve(posting.account)
+    if found is None:
+        return None
+    prefix, holds = found
+    holding_account = holds['later'] if later else holds['earlier']
+    return posting._replace(account=holding_account + posting.account[len(prefix):])
+
+
+def splice(entries, positions, split):
+    """Return entries with each entry at positions replaced by whatever split(entry, out) appends to out.
+    The entries in between are copied over in slices, without being looked at."""
+    new_entries = []
+    prev = 0
+    for i in positions:
+        new_entries.extend(entries[prev:i])
+        split(entries[i], new_entries)
+        prev = i + 1
+    new_entries.extend(entries[prev:])
+    return new_entries
+
+
+def split_entry(entry, resolve, out, new_accounts, errors, holdings=None):
+    """Append the effective date entries for entry to out, followed by entry itself with its effective
+    dated postings moved to holding accounts. Each amount parked in a holding account is recorded in
+    holdings (a holdings.HoldingsIndex), if given."""
+
+    # add a link to each effective date entry. this gets copied over to the newly created effective date
+    # entries, and thus links each set of effective date entries
+    entry = entry._replace(links=(entry.links or set()) | set([make_link(entry)]))
+
+    modified_entry_postings = []
+    for posting in entry.postings:
+        if not (has_valid_effective_date(posting) or has_effective_date_range(posting)):
+            modified_entry_postings += [posting]
+            continue
+        try:
+            dates = posting_calendar(posting)
+        except ValueError as e:
+            errors.append(EffectiveDateError(posting.meta, "effective_date: {}".format(e), entry))
+            modified_entry_postings += [posting]
+            continue
+
+        # Replace posting in original entry with holding account. A range is held in the 'later' account if
+        # any of it falls after the entry, eg: a payment spread over the year starting on its own date
+        new_posting = holding_posting(posting, resolve, later=dates[-1] > entry.date)
+        if new_posting is None:
+            errors.append(EffectiveDateError(
+                posting.meta, "effective_date: no holding account configured for {}".format(posting.account), entry))
+            modified_entry_postings += [posting]
+            continue
+        new_accounts.add(new_posting.account)
+        modified_entry_postings.append(new_posting)
+
+        # Create new entries at each effective date
+        hold_posting = cleaned(new_posting)
+        original_posting = cleaned(posting)
+        for date, number in spread(posting.units.number, dates):
+            units = posting.units._replace(number=number)
+            new_entry = create_new_effective_date_entry(entry, date, hold_posting._replace(units=-units),
+                                                        original_posting._replace(units=units))
+            out.append(new_entry)
+            if holdings is not None:
+                holdings.add(entry.date, date, new_posting.account, units, new_entry)
+    out.append(entry._replace(postings=modified_entry_postings))
+
+
+def split_entry_transaction(entry, resolve, out, new_accounts):
+    """Transaction-level counterpart of split_entry(), for effective_date_transaction(). Every posting
+    with a holding account is moved into a single new entry at the transaction's effective_date."""
+    effective_date = entry.meta['effective_date']
+    modified_entry_postings = []
+    effective_date_entry_postings = []
+    for posting in entry.postings:
+        new_posting = holding_posting(posting, resolve, later=effective_date > entry.date)
+        if new_posting is None:
+            modified_entry_postings.append(posting)
+            continue
+        new_accounts.add(new_posting.account)
+        new_accounts.add(posting.account)
+        modified_entry_postings.append(new_posting)
+        effective_date_entry_postings += [posting, new_posting._replace(units=-posting.units)]
+
+    if not effective_date_entry_postings:
+        out.append(entry)
+        return
+
+    links = (entry.links or set()) | set([make_link(entry)])
+    modified_entry = entry._replace(postings=modified_entry_postings, links=links)
+    effective_date_entry_narration = entry.narration + " (originally: {})".format(str(entry.date))
+    new_meta = {'original_date': entry.date}
+    effective_date_entry = entry._replace(date=effective_date,
+                                          meta={**entry.meta, **new_meta},
+                                          postings=effective_date_entry_postings,
+                                          narration=effective_date_entry_narration,
+                                          links=links)
+    out += [modified_entry, effective_date_entry]
+
+
+def effective_date(entries, options_map, config, holdings=None):
     """Effective dates
 
     Args:
@@ -67,81 +310,40 @@ def effective_date(entries, options_map, config):
       config: A configuration string, which is intended to be a Python dict
         mapping match-accounts to a pair of (negative-account, position-account)
         account names.
+      holdings: optional holdings.HoldingsIndex, which is filled with every amount parked in a holding
+        account, for "what was held on date D" queries. Not available when run as a plugin.
     Returns:
       A tuple of entries and errors.
 
+    Postings may carry either an 'effective_date', or an 'effective_date_range' (a string such as
+    '2024-01-01..2024-12-31') with an optional 'effective_date_period' (daily, weekly, monthly
+    (default), quarterly or yearly), in which case the posting is spread evenly over one new entry
+    per period in the range.
+
     """
     start_time = time.time()
     errors = []
-    holding_accts = build_config(config)
-
-    interesting_entries = []
-    filtered_entries = []
-    new_accounts = set()
-    for entry in entries:
-        if isinstance(entry, data.Transaction) and has_posting_with_valid_effective_date(entry):
-            interesting_entries.append(entry)
-        else:
-            filtered_entries.append(entry)
-
-    # if DEBUG:
-    #     print("effective_date: ------")
-    #     for e in interesting_entries:
-    #         printer.print_entry(e)
-    #     print("effective_date: ------")
+    resolve = compile_config(build_config(config))
 
-    # add a link to each effective date entry. this gets copied over to the newly created effective date
-    # entries, and thus links each set of effective date entries
-    interesting_entries_linked = []
-    for entry in interesting_entries:
-        rand_string = ''.join(random.choice(string.ascii_lowercase) for i in range(3))
-        date = str(entry.date).replace('-', '')[2:]
-        link = LINK_FORMAT.format(date=str(date), random=rand_string)
-        new_entry = entry._replace(links=(entry.links or set()) | set([link]))
-        interesting_entries_linked.append(new_entry)
+    # First, a cheap scan that only records where the interesting entries are. Everything else is passed
+    # through as is, without being copied into intermediate lists
+    positions = [i for i, entry in enumerate(entries)
+                 if isinstance(entry, data.Transaction) and has_posting_with_valid_effective_date(entry)]
+    if not positions:
+        return entries, errors
 
-    new_entries = []
-    for entry in interesting_entries_linked:
-        modified_entry_postings = []
-        for posting in entry.postings:
-            if not has_valid_effective_date(posting):
-                modified_entry_postings += [posting]
-            else:
-                found_acct = ''
-                for acct in holding_accts:
-                    if posting.account.startswith(acct):
-                        found_acct = acct
-
-                # find earlier or later (is this necessary?)
-                holding_account = holding_accts[found_acct]['earlier']
-                if posting.meta['effective_date'] > entry.date:
-                    holding_account = holding_accts[found_acct]['later']
-
-                # Replace posting in original entry with holding account
-                new_posting = posting._replace(account=posting.account.replace(found_acct, holding_account))
-                new_accounts.add(new_posting.account)
-                modified_entry_postings.append(new_posting)
-
-                # Create new entry at effective_date
-                hold_posting = new_posting._replace(units=-posting.units)
-                new_entry = create_new_effective_date_entry(entry, posting.meta['effective_date'],
-                                                            hold_posting, posting)
-                new_entries.append(new_entry)
-        modified_entry = entry._replace(postings=modified_entry_postings)
-        new_entries.append(modified_entry)
-
-    # if DEBUG:
-    #     print("Output results:")
-    #     for e in new_entries:
-    #         printer.print_entry(e)
+    new_accounts = set()
+    new_entries = splice(entries, positions,
+                         lambda entry, out: split_entry(entry, resolve, out, new_accounts, errors, holdings))
 
     if DEBUG:
         elapsed_time = time.time() - start_time
-        print("effective_date [{:.1f}s]: {} entries inserted.".format(elapsed_time, len(new_entries)))
+        print("effective_date [{:.1f}s]: {} entries inserted.".format(elapsed_time, len(new_entries) - len(entries)),
+              file=sys.stderr)
 
-    new_open_entries = common.create_open_directives(new_accounts, entries, meta_desc='<effective_date>')
-    retval = new_open_entries + new_entries + filtered_entries
-    return retval, errors
+    # Appended rather than prepended, to avoid copying the whole ledger again: the loader re-sorts plugin output
+    new_entries.extend(common.create_open_directives(new_accounts, entries, meta_desc='<effective_date>'))
+    return new_entries, errors
 
 
 def effective_date_transaction(entries, options_map, config):
@@ -201,98 +403,26 @@ def effective_date_transaction(entries, options_map, config):
 
     start_time = time.time()
     errors = []
+    resolve = compile_config(build_config(config, default=LEGACY_HOLDING_ACCTS))
 
-    interesting_entries = []
-    filtered_entries = []
-    new_accounts = []
-    for entry in entries:
-        outlist = (interesting_entries
-                   if (isinstance(entry, data.Transaction) and
-                       'effective_date' in entry.meta and
-                       type(entry.meta['effective_date']) is datetime.date)
-                   else filtered_entries)
-        outlist.append(entry)
-
-    # print("------")
-    # for e in interesting_entries:
-    #     # print(e)
-    #     printer.print_entry(e)
-    #     print(type(e.meta.effective_date) is datetime.date)
-    #     print("")
-    # print("------")
-
-    modcount = 0
-    new_entries = []
-    for entry in interesting_entries:
-        modified_entry_postings = []
-        effective_date_entry_postings = []
-        found = False
-        accts_to_split = {
-                'Expenses': {'earlier': 'Liabilities:Hold', 'later': 'Assets:Hold'},
-                'Income':   {'earlier': 'Assets:Hold', 'later': 'Liabilities:Hold'},
-                }
-        for posting in entry.postings:
-            if any(acct in posting.account for acct in accts_to_split):
-                found_acct = ''
-                for acct in accts_to_split:
-                    if posting.account.startswith(acct):
-                        found_acct = acct
-                found = True
-                modcount += 1
-
-                holding_account = accts_to_split[found_acct]['earlier']
-                if entry.meta['effective_date'] > entry.date:
-                    holding_account = accts_to_split[found_acct]['later']
-                new_posting = posting._replace(account=posting.account.replace(found_acct, holding_account))
-                if new_posting.account not in new_accounts:
-                    new_accounts.append(new_posting.account)
-                modified_entry_postings += [new_posting]
-                effective_date_entry_postings += [posting]
-
-                effective_date_entry_postings += [posting._replace(
-                    account=posting.account.replace(found_acct, holding_account),
-                    units=-posting.units)]
-
-                if posting.account not in new_accounts:
-                    new_accounts.append(posting.account)
-
-            else:
-                modified_entry_postings += [posting]
-
-        if found:
-            rand_string = ''.join(random.choice(string.ascii_uppercase) for i in range(5))
-            link = LINK_FORMAT.format(rand_string)
-            # modified_entry = data.entry_replace(entry, postings=modified_entry_postings,
-            #                                     links=(entry.links or set()) | set([link]))
-            modified_entry = entry._replace(postings=modified_entry_postings,
-                                            links=(entry.links or set()) | set([link]))
-
-            effective_date_entry_narration = entry.narration + " (originally: {})".format(str(entry.date))
-            # effective_date_entry = data.entry_replace(entry, date=entry.meta['effective_date'],
-            #         postings=effective_date_entry_postings,
-            #         narration = effective_date_entry_narration,
-            #         links=(entry.links or set()) | set([link]))
-            new_meta = {'original_date': entry.date}
-            effective_date_entry = entry._replace(date=entry.meta['effective_date'],
-                                                  meta={**entry.meta, **new_meta},
-                                                  postings=effective_date_entry_postings,
-                                                  narration=effective_date_entry_narration,
-                                                  links=(entry.links or set()) | set([link]))
-            new_entries += [modified_entry, effective_date_entry]
-        else:
-            new_entries += [entry]
-
-    # print("Output results:")
-    # for e in new_entries:
-    #     printer.print_entry(e)
+    positions = [i for i, entry in enumerate(entries)
+                 if (isinstance(entry, data.Transaction) and
+                     type(entry.meta.get('effective_date')) is datetime.date)]
+    if not positions:
+        return entries, errors
+
+    new_accounts = set()
+    new_entries = splice(entries, positions,
+                         lambda entry, out: split_entry_transaction(entry, resolve, out, new_accounts))
 
     if DEBUG:
         elapsed_time = time.time() - start_time
-        print("effective_date_transaction [{:.1f}s]: {} entries inserted.".format(elapsed_time, modcount))
+        print("effective_date_transaction [{:.1f}s]: {} entries inserted.".format(
+              elapsed_time, len(new_entries) - len(entries)), file=sys.stderr)
 
-    new_open_entries = common.create_open_directives(new_accounts, entries, meta_desc='<effective_date>')
-    retval = new_open_entries + new_entries + filtered_entries
-    return retval, errors
+    # Appended rather than prepended, to avoid copying the whole ledger again: the loader re-sorts plugin output
+    new_entries.extend(common.create_open_directives(new_accounts, entries, meta_desc='<effective_date>'))
+    return new_entries, errors
 
 # TODO
 # -----------------------------------------------------------------------------------------------------------
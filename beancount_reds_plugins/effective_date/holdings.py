@@ -0,0 +1,153 @@
+"""Index of what sat in effective_date holding accounts, and when.
+
+Each effective dated posting parks an amount in a holding account between its original date and its
+effective date. This module indexes those intervals to answer "what was held on date D" and "what was
+held at any point between D1 and D2" without replaying the ledger:
+
+    holdings = HoldingsIndex()
+    entries, errors = effective_date(entries, options_map, config, holdings=holdings)
+    holdings.balances(datetime.date(2015, 1, 1))    # {(account, currency): number}
+    holdings.outstanding(datetime.date(2015, 1, 1))  # [Holding, ...]
+    holdings.between(datetime.date(2015, 1, 1), datetime.date(2015, 3, 31))
+
+An index can also be rebuilt from a ledger that was already processed by the plugin, using
+HoldingsIndex.from_entries().
+
+An amount is considered held from (and including) the earlier of the two dates, up to (but excluding)
+the later one. Amounts are as seen by the holding account: positive when an expense is booked later than
+it was paid, negative when it is booked earlier.
+"""
+
+import bisect
+import collections
+from itertools import accumulate
+
+from beancount.core import data
+from beancount_reds_plugins.effective_date import effective_date
+
+Holding = collections.namedtuple('Holding', 'original_date effective_date account units entry')
+
+
+def holding_start(holding):
+    return min(holding.original_date, holding.effective_date)
+
+
+def holding_end(holding):
+    return max(holding.original_date, holding.effective_date)
+
+
+class HoldingsIndex:
+    """Static interval index over Holdings. Built lazily on the first query after any add()."""
+
+    def __init__(self):
+        self._holdings = []
+        self._built = True
+        self._starts = []
+        self._max_end = []
+        self._balances = {}
+
+    def __len__(self):
+        return len(self._holdings)
+
+    def add(self, original_date, effective_date, account, units, entry=None):
+        """Record units booked to a holding account on original_date, and moved out on effective_date."""
+        if original_date == effective_date:
+            return
+        if effective_date < original_date:
+            units = -units
+        self._holdings.append(Holding(original_date, effective_date, account, units, entry))
+        self._built = False
+
+    @classmethod
+    def from_entries(cls, entries, holding_accts=None):
+        """Rebuild an index from entries that effective_date() or effective_date_transaction() has already
+        processed.
+
+        Holding postings are recognized by account: those under the 'earlier' or 'later' accounts of
+        holding_accts, which must be the config the plugin ran with (effective_date's default config if
+        None; effective_date_transaction's default is effective_date.LEGACY_HOLDING_ACCTS)."""
+        if holding_accts is None:
+            holding_accts = effective_date.DEFAULT_HOLDING_ACCTS
+        holding_prefixes = {account for holds in holding_accts.values() for account in holds.values()}
+        memo = {}
+
+        def is_holding_account(account):
+            try:
+                return memo[account]
+            except KeyError:
+                components = account.split(':')
+                memo[account] = result = any(':'.join(components[:i]) in holding_prefixes
+                                             for i in range(1, len(components) + 1))
+                return result
+
+        index = cls()
+        for entry in entries:
+            if isinstance(entry, data.Transaction) and 'original_date' in entry.meta:
+                for posting in entry.postings:
+                    if is_holding_account(posting.account):
+                        index.add(entry.meta['original_date'], entry.date, posting.account, -posting.units, entry)
+        return index
+
+    def _build(self):
+        # Holdings sorted by start form an implicit balanced binary tree: the node for the range [lo, hi)
+        # is its midpoint, and _max_end[mid] is the latest end of any holding in that range
+        self._holdings.sort(key=holding_start)
+        self._starts = [holding_start(h) for h in self._holdings]
+        self._max_end = [None] * len(self._holdings)
+
+        def fill(lo, hi):
+            if lo >= hi:
+                return None
+            mid = (lo + hi) // 2
+            ends = [holding_end(self._holdings[mid]), fill(lo, mid), fill(mid + 1, hi)]
+            self._max_end[mid] = max(e for e in ends if e is not None)
+            return self._max_end[mid]
+        fill(0, len(self._holdings))
+
+        # Per (account, currency): sorted starts and ends, with running sums, for balance queries
+        events = collections.defaultdict(lambda: ([], []))
+        for h in self._holdings:
+            starts, ends = events[(h.account, h.units.currency)]
+            starts.append((holding_start(h), h.units.number))
+            ends.append((holding_end(h), h.units.number))
+        self._balances = {}
+        for key, (starts, ends) in events.items():
+            ends.sort(key=lambda e: e[0])
+            self._balances[key] = ([d for d, _ in starts], list(accumulate(n for _, n in starts)),
+                                   [d for d, _ in ends], list(accumulate(n for _, n in ends)))
+        self._built = True
+
+    def _search(self, lo, hi, start, end, out):
+        if lo >= hi or self._max_end[(lo + hi) // 2] <= start:
+            return
+        mid = (lo + hi) // 2
+        self._search(lo, mid, start, end, out)
+        if self._starts[mid] <= end:
+            if holding_end(self._holdings[mid]) > start:
+                out.append(self._holdings[mid])
+            self._search(mid + 1, hi, start, end, out)
+
+    def between(self, start, end):
+        """Holdings outstanding at any point from start to end (both inclusive), in order of start."""
+        if not self._built:
+            self._build()
+        out = []
+        self._search(0, len(self._holdings), start, end, out)
+        return out
+
+    def outstanding(self, date):
+        """Holdings outstanding on date, in order of start."""
+        return self.between(date, date)
+
+    def balances(self, date):
+        """Total held on date, as a dict of (account, currency) -> number. Zero balances are omitted."""
+        if not self._built:
+            self._build()
+        result = {}
+        for key, (start_dates, start_sums, end_dates, end_sums) in self._balances.items():
+            i = bisect.bisect_right(start_dates, date)
+            j = bisect.bisect_right(end_dates, date)
+            total = (start_sums[i - 1] if i else 0) - (end_sums[j - 1] if j else 0)
+            if total:
+                result[key] = total
+        return result
@@ -4,8 +4,10 @@ __license__ = "GNU GPLv3"
 import unittest
 import re
 
-from beancount_reds_plugins.effective_date.effective_date import effective_date
+from beancount_reds_plugins.effective_date.effective_date import effective_date, effective_date_transaction
+from beancount_reds_plugins.effective_date.effective_date import spread, spread_calendar
 from beancount.core import data
+from beancount.core.number import D
 from beancount.parser import options
 from beancount import loader
 import datetime
@@ -44,7 +46,32 @@ class TestEffectiveDate(unittest.TestCase):
           Expenses:Taxes:Federal  2000 USD
          """
         new_entries, _ = effective_date(entries, options_map, None)
-        self.assertEqual(new_entries, entries)
+        self.assertIs(new_entries, entries)
+
+    @loader.load_doc()
+    def test_untouched_entries_passed_through(self, entries, _, options_map):
+        """
+        2014-01-01 open Liabilities:Mastercard
+        2014-01-01 open Expenses:Taxes:Federal
+
+        2014-01-15 * "Groceries"
+          Liabilities:Mastercard    -20 USD
+          Expenses:Taxes:Federal     20 USD
+
+        2014-02-01 * "Estimated taxes for 2013"
+          Liabilities:Mastercard    -2000 USD
+          Expenses:Taxes:Federal  2000 USD
+            effective_date: 2013-12-31
+
+        2014-03-01 * "Coffee"
+          Liabilities:Mastercard    -2 USD
+          Expenses:Taxes:Federal     2 USD
+        """
+        new_entries, _ = effective_date(entries, options_map, None)
+        untouched = [e for e in entries if not get_entries_with_narration([e], "Estimated taxes")]
+        for entry in untouched:
+            self.assertTrue(any(entry is e for e in new_entries))
+        self.assertEqual(len(entries) + 2, len(new_entries))
 
     @loader.load_doc()
     def test_expense_earlier(self, entries, _, options_map):
@@ -142,3 +169,177 @@ class TestEffectiveDate(unittest.TestCase):
 
         new_entries, _ = effective_date(entries, options_map, None)
         self.assertEqual(7, len(new_entries))
+
+    @loader.load_doc()
+    def test_range_monthly(self, entries, _, options_map):
+        """
+        2014-01-01 open Liabilities:Mastercard
+        2014-01-01 open Expenses:Insurance
+
+        2014-01-01 * "Annual insurance"
+          Liabilities:Mastercard    -1200 USD
+          Expenses:Insurance         1200 USD
+            effective_date_range: "2014-02-01..2015-01-31"
+        """
+        new_entries, errors = effective_date(entries, options_map, None)
+        self.assertEqual([], errors)
+
+        results = get_entries_with_narration(new_entries, "Annual insurance")
+        self.assertEqual(13, len(results))
+        slices = [e for e in results if 'original_date' in e.meta]
+        expected_dates = [datetime.date(2014, m, 1) for m in range(2, 13)] + [datetime.date(2015, 1, 1)]
+        self.assertEqual(expected_dates, [e.date for e in slices])
+        for e in slices:
+            self.assertEqual(['Assets:Hold:Expenses:Insurance', 'Expenses:Insurance'],
+                             [p.account for p in e.postings])
+            self.assertEqual(D('100'), e.postings[1].units.number)
+            self.assertNotIn('effective_date_range', e.postings[1].meta)
+
+    @loader.load_doc()
+    def test_range_starting_on_entry_date(self, entries, _, options_map):
+        """
+        2014-01-01 open Liabilities:Mastercard
+        2014-01-01 open Expenses:Insurance
+
+        2014-01-01 * "Annual insurance"
+          Liabilities:Mastercard    -1200 USD
+          Expenses:Insurance         1200 USD
+            effective_date_range: "2014-01-01..2014-12-31"
+        """
+        new_entries, errors = effective_date(entries, options_map, None)
+        self.assertEqual([], errors)
+
+        results = get_entries_with_narration(new_entries, "Annual insurance")
+        slices = [e for e in results if 'original_date' in e.meta]
+        self.assertEqual(datetime.date(2014, 1, 1), slices[0].date)
+        self.assertEqual({'Assets:Hold:Expenses:Insurance'},
+                         {e.postings[0].account for e in slices})
+        original = [e for e in results if 'original_date' not in e.meta][0]
+        self.assertEqual('Assets:Hold:Expenses:Insurance', original.postings[1].account)
+
+    @loader.load_doc()
+    def test_range_remainder(self, entries, _, options_map):
+        """
+        2014-01-01 open Liabilities:Mastercard
+        2014-01-01 open Expenses:Insurance
+
+        2014-01-01 * "Quarterly insurance"
+          Liabilities:Mastercard    -1000.00 USD
+          Expenses:Insurance         1000.00 USD
+            effective_date_range: "2014-01-31..2014-12-31"
+            effective_date_period: "quarterly"
+        """
+        new_entries, errors = effective_date(entries, options_map, None)
+        self.assertEqual([], errors)
+
+        slices = [e for e in get_entries_with_narration(new_entries, "Quarterly insurance")
+                  if 'original_date' in e.meta]
+        self.assertEqual([datetime.date(2014, 1, 31), datetime.date(2014, 4, 30),
+                          datetime.date(2014, 7, 31), datetime.date(2014, 10, 31)],
+                         [e.date for e in slices])
+        self.assertEqual([D('250.00')] * 4, [e.postings[1].units.number for e in slices])
+
+    def test_spread_remainder(self):
+        dates = spread_calendar(datetime.date(2014, 1, 1), datetime.date(2014, 3, 31), 'monthly')
+        self.assertEqual([D('-333.34'), D('-333.33'), D('-333.33')],
+                         [n for _, n in spread(D('-1000'), dates)])
+
+    @loader.load_doc()
+    def test_range_invalid(self, entries, _, options_map):
+        """
+        2014-01-01 open Liabilities:Mastercard
+        2014-01-01 open Expenses:Insurance
+
+        2014-01-01 * "Insurance"
+          Liabilities:Mastercard    -1000 USD
+          Expenses:Insurance         1000 USD
+            effective_date_range: "2014-01-01..2014-12-31"
+            effective_date_period: "fortnightly"
+        """
+        new_entries, errors = effective_date(entries, options_map, None)
+        self.assertEqual(1, len(errors))
+        results = get_entries_with_narration(new_entries, "Insurance")
+        self.assertEqual(1, len(results))
+        self.assertEqual('Expenses:Insurance', results[0].postings[1].account)
+
+    @loader.load_doc()
+    def test_longest_prefix(self, entries, _, options_map):
+        """
+        2014-01-01 open Liabilities:Mastercard
+        2014-01-01 open Expenses:Taxes:Federal
+        2014-01-01 open Expenses:Rent
+
+        2014-02-01 * "Estimated taxes for 2013"
+          Liabilities:Mastercard    -2100 USD
+          Expenses:Taxes:Federal  2000 USD
+            effective_date: 2013-12-31
+          Expenses:Rent  100 USD
+            effective_date: 2014-03-01
+        """
+        config = """{
+          'Expenses': {'earlier': 'Liabilities:Hold:Expenses', 'later': 'Assets:Hold:Expenses'},
+          'Expenses:Taxes': {'earlier': 'Liabilities:Hold:Taxes', 'later': 'Assets:Hold:Taxes'},
+        }"""
+        new_entries, errors = effective_date(entries, options_map, config)
+        self.assertEqual([], errors)
+        original = [e for e in get_entries_with_narration(new_entries, "Estimated taxes")
+                    if 'original_date' not in e.meta][0]
+        self.assertEqual(['Liabilities:Mastercard', 'Liabilities:Hold:Taxes:Federal', 'Assets:Hold:Expenses:Rent'],
+                         [p.account for p in original.postings])
+
+    @loader.load_doc()
+    def test_no_holding_account(self, entries, _, options_map):
+        """
+        2014-01-01 open Liabilities:Mastercard
+        2014-01-01 open Assets:Bank
+
+        2014-02-01 * "Transfer"
+          Liabilities:Mastercard    -2000 USD
+          Assets:Bank  2000 USD
+            effective_date: 2013-12-31
+        """
+        new_entries, errors = effective_date(entries, options_map, None)
+        self.assertEqual(1, len(errors))
+        self.assertEqual(entries[-1].postings, new_entries[-1].postings)
+
+
+class TestEffectiveDateTransaction(unittest.TestCase):
+
+    @loader.load_doc()
+    def test_no_effective_dates(self, entries, _, options_map):
+        """
+        2014-01-01 open Liabilities:Mastercard
+        2014-01-01 open Expenses:Taxes:Federal
+
+        2014-02-01 * "Estimated taxes for 2013"
+          Liabilities:Mastercard    -2000 USD
+          Expenses:Taxes:Federal  2000 USD
+         """
+        new_entries, _ = effective_date_transaction(entries, options_map, None)
+        self.assertIs(new_entries, entries)
+
+    @loader.load_doc()
+    def test_expense_earlier(self, entries, _, options_map):
+        """
+        2014-01-01 open Liabilities:Mastercard
+        2014-01-01 open Expenses:Taxes:Federal
+
+        2014-02-01 * "Estimated taxes for 2013"
+          effective_date: 2013-12-31
+          Liabilities:Mastercard    -2000 USD
+          Expenses:Taxes:Federal  2000 USD
+        """
+        new_entries, errors = effective_date_transaction(entries, options_map, None)
+        self.assertEqual([], errors)
+        self.assertEqual(5, len(new_entries))
+
+        original, effective = get_entries_with_narration(new_entries, "Estimated taxes")
+        self.assertEqual(datetime.date(2014, 2, 1), original.date)
+        self.assertEqual(['Liabilities:Mastercard', 'Liabilities:Hold:Taxes:Federal'],
+                         [p.account for p in original.postings])
+        self.assertEqual(datetime.date(2013, 12, 31), effective.date)
+        self.assertEqual(['Expenses:Taxes:Federal', 'Liabilities:Hold:Taxes:Federal'],
+                         [p.account for p in effective.postings])
+        self.assertEqual(D('-2000'), effective.postings[1].units.number)
+        self.assertEqual(original.links, effective.links)
+        self.assertTrue(next(iter(original.links)).startswith('edate-140201-'))
@@ -0,0 +1,89 @@
+__copyright__ = "Copyright (C) 2020  Red S"
+__license__ = "GNU GPLv3"
+
+import datetime
+import unittest
+
+from beancount_reds_plugins.effective_date.effective_date import effective_date
+from beancount_reds_plugins.effective_date.effective_date import effective_date_transaction, LEGACY_HOLDING_ACCTS
+from beancount_reds_plugins.effective_date.holdings import HoldingsIndex
+from beancount.core.amount import A
+from beancount.core.number import D
+from beancount import loader
+
+
+class TestHoldingsIndex(unittest.TestCase):
+
+    def test_empty(self):
+        holdings = HoldingsIndex()
+        self.assertEqual([], holdings.outstanding(datetime.date(2014, 1, 1)))
+        self.assertEqual({}, holdings.balances(datetime.date(2014, 1, 1)))
+
+    def test_intervals(self):
+        holdings = HoldingsIndex()
+        holdings.add(datetime.date(2014, 1, 1), datetime.date(2014, 3, 1), 'Assets:Hold', A('10 USD'))
+        holdings.add(datetime.date(2014, 2, 1), datetime.date(2014, 2, 15), 'Assets:Hold', A('5 USD'))
+        holdings.add(datetime.date(2014, 6, 1), datetime.date(2014, 5, 1), 'Liabilities:Hold', A('7 USD'))
+
+        self.assertEqual([], holdings.outstanding(datetime.date(2013, 12, 31)))
+        self.assertEqual(2, len(holdings.outstanding(datetime.date(2014, 2, 1))))
+        self.assertEqual(1, len(holdings.outstanding(datetime.date(2014, 2, 15))))
+        self.assertEqual([], holdings.outstanding(datetime.date(2014, 3, 1)))
+        self.assertEqual(2, len(holdings.between(datetime.date(2014, 2, 20), datetime.date(2014, 5, 1))))
+        self.assertEqual(1, len(holdings.between(datetime.date(2014, 3, 1), datetime.date(2014, 12, 31))))
+
+        self.assertEqual({('Assets:Hold', 'USD'): D('15')}, holdings.balances(datetime.date(2014, 2, 10)))
+        self.assertEqual({('Liabilities:Hold', 'USD'): D('-7')}, holdings.balances(datetime.date(2014, 5, 15)))
+        self.assertEqual({}, holdings.balances(datetime.date(2014, 6, 1)))
+
+    @loader.load_doc()
+    def test_from_plugin(self, entries, _, options_map):
+        """
+        2014-01-01 open Liabilities:Mastercard
+        2014-01-01 open Expenses:Insurance
+        2014-01-01 open Expenses:Taxes
+
+        2014-01-01 * "Insurance"
+          Liabilities:Mastercard    -300 USD
+          Expenses:Insurance         300 USD
+            effective_date_range: "2014-02-01..2014-04-30"
+
+        2014-02-01 * "Estimated taxes for 2013"
+          Liabilities:Mastercard    -2000 USD
+          Expenses:Taxes  2000 USD
+            effective_date: 2013-12-31
+        """
+        holdings = HoldingsIndex()
+        new_entries, _ = effective_date(entries, options_map, None, holdings=holdings)
+        self.assertEqual(4, len(holdings))
+
+        expected = {('Assets:Hold:Expenses:Insurance', 'USD'): D('300'),
+                    ('Liabilities:Hold:Expenses:Taxes', 'USD'): D('-2000')}
+        self.assertEqual(expected, holdings.balances(datetime.date(2014, 1, 15)))
+        self.assertEqual(4, len(holdings.outstanding(datetime.date(2014, 1, 31))))
+
+        rebuilt = HoldingsIndex.from_entries(new_entries)
+        for date in (datetime.date(2014, 1, 15), datetime.date(2014, 3, 15)):
+            self.assertEqual(holdings.balances(date), rebuilt.balances(date))
+
+    @loader.load_doc()
+    def test_from_transaction_plugin(self, entries, _, options_map):
+        """
+        2014-01-01 open Liabilities:Mastercard
+        2014-01-01 open Expenses:Taxes:Federal
+        2014-01-01 open Expenses:Taxes:State
+
+        2014-02-01 * "Estimated taxes for 2013"
+          effective_date: 2013-12-31
+          Liabilities:Mastercard    -2500 USD
+          Expenses:Taxes:Federal     2000 USD
+          Expenses:Taxes:State        500 USD
+        """
+        new_entries, _ = effective_date_transaction(entries, options_map, None)
+
+        # The holding posting comes second in effective_date_transaction's entries: it is found by account
+        rebuilt = HoldingsIndex.from_entries(new_entries, LEGACY_HOLDING_ACCTS)
+        self.assertEqual({('Liabilities:Hold:Taxes:Federal', 'USD'): D('-2000'),
+                          ('Liabilities:Hold:Taxes:State', 'USD'): D('-500')},
+                         rebuilt.balances(datetime.date(2014, 1, 15)))
+        self.assertEqual({}, rebuilt.balances(datetime.date(2014, 2, 1)))
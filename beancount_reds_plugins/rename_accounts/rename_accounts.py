@@ -1,14 +1,182 @@
 """See accompanying README.md"""
 
+import collections
 import re
 import time
 from ast import literal_eval
+from beancount.core import account as account_lib
 from beancount.core import data
 
 DEBUG = 0
 __plugins__ = ('rename_accounts',)
 
 
+REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+
+# Name prefix of the group of each pattern in the combined regexp
+GROUP_PREFIX = '_rename'
+
+
+def is_literal(pattern, replacement):
+    """Whether a rename is a plain substring replacement, so that str.replace() gives the same result as
+    re.subn()."""
+    return not REGEX_METACHARACTERS.intersection(pattern) and '\\' not in replacement
+
+
+def compile_renames(renames):
+    """Compile a dict of renames (pattern -> replacement) for make_renamer().
+
+    Returns a list of (is_literal, pattern, replacement) tuples in config order, where pattern is a string
+    for literal renames and a compiled regexp otherwise. And a single regexp, with a named group per
+    pattern, whose match() finds the first pattern (in config order) found anywhere in an account, or None if
+    the patterns can't be combined (eg: they contain backreferences)."""
+    compiled = [(True, pattern, replacement) if is_literal(pattern, replacement)
+                else (False, re.compile(pattern), replacement)
+                for pattern, replacement in renames.items()]
+    if not compiled or any(re.search(r'\\\d|\(\?P=', pattern) for pattern in renames):
+        return compiled, None
+    # Each alternative scans the whole account before the next one is tried, so the first pattern listed wins
+    # even if a later one matches further left
+    alternation = '|'.join('(?P<{}{}>.*?(?:{}))'.format(GROUP_PREFIX, i, re.escape(p) if literal else p.pattern)
+                           for i, (literal, p, _) in enumerate(compiled))
+    try:
+        return compiled, re.compile(alternation)
+    except re.error:  # eg: inline global flags, which are only allowed at the start
+        return compiled, None
+
+
+def make_renamer(compiled, any_match):
+    """Return a function applying renames to an account, as compiled by compile_renames().
+
+    Renames are applied in order, each to the result of the previous one. The function returns the
+    resulting account name and whether or not it was renamed. A single pass of the combined regexp skips
+    accounts that no pattern matches, typically most of them, and the renames before the first matching
+    one, which can't have changed the account. Results are memoized, since a ledger has far fewer distinct
+    accounts than postings."""
+    memo = {}
+
+    def rename_account(account):
+        try:
+            return memo[account]
+        except KeyError:
+            pass
+        new_account = account
+        was_renamed = False
+        first = 0
+        if any_match is not None:
+            m = any_match.match(account)
+            first = int(m.lastgroup[len(GROUP_PREFIX):]) if m else len(compiled)
+        for literal, pattern, replacement in compiled[first:]:
+            if literal:
+                if pattern in new_account:
+                    new_account = new_account.replace(pattern, replacement)
+                    was_renamed = True
+            else:
+                new_account, num_replacements = pattern.subn(replacement, new_account)
+                if num_replacements > 0:
+                    was_renamed = True
+        memo[account] = new_account, was_renamed
+        return new_account, was_renamed
+    return rename_account
+
+
+def parse_config(config):
+    """Return the renames dict, the set of metadata keys holding accounts to rename, and whether to rename
+    accounts in Custom directives.
+
+    The config is either a dict of renames, or a dict with a 'renames' key and optional 'metadata_keys' and
+    'custom' keys. The two can't be confused: rename replacements are strings, not dicts."""
+    config_obj = literal_eval(config)
+    if not isinstance(config_obj.get('renames'), dict):
+        return config_obj, frozenset(), False
+    return (config_obj['renames'], frozenset(config_obj.get('metadata_keys', ())),
+            bool(config_obj.get('custom', False)))
+
+
+def rename_meta(meta, rename_account, metadata_keys):
+    """Return meta with the accounts in metadata_keys renamed, or meta itself if none were."""
+    if not meta or metadata_keys.isdisjoint(meta):
+        return meta
+    new_meta = None
+    for key in metadata_keys.intersection(meta):
+        value = meta[key]
+        if isinstance(value, str):
+            new_value, was_renamed = rename_account(value)
+            if was_renamed:
+                if new_meta is None:
+                    new_meta = dict(meta)
+                new_meta[key] = new_value
+    return meta if new_meta is None else new_meta
+
+
+def rename_values(entry, rename_account, metadata_keys, custom):
+    """Rename the accounts held in the metadata values (of the entry and its postings) listed in
+    metadata_keys, and if custom is true, the account values of Custom directives.
+
+    Returns entry itself if nothing was renamed."""
+    new_meta = rename_meta(entry.meta, rename_account, metadata_keys)
+    if new_meta is not entry.meta:
+        entry = entry._replace(meta=new_meta)
+    if isinstance(entry, data.Transaction) and metadata_keys:
+        postings = []
+        for posting in entry.postings:
+            meta = rename_meta(posting.meta, rename_account, metadata_keys)
+            postings.append(posting if meta is posting.meta else posting._replace(meta=meta))
+        if any(new is not old for new, old in zip(postings, entry.postings)):
+            entry = entry._replace(postings=postings)
+    elif isinstance(entry, data.Custom) and custom:
+        values = [value._replace(value=rename_account(value.value)[0]) if value.dtype == account_lib.TYPE else value
+                  for value in entry.values]
+        if any(new.value != old.value for new, old in zip(values, entry.values)):
+            entry = entry._replace(values=values)
+    return entry
+
+
+def merge_opens(open1, open2):
+    """Merge two Open directives for the same account: the earliest date, and the union of currencies (none
+    means any currency)."""
+    if open1.currencies is None or open2.currencies is None:
+        currencies = None
+    else:
+        currencies = open1.currencies + [c for c in open2.currencies if c not in open1.currencies]
+    return open1._replace(date=min(open1.date, open2.date), currencies=currencies,
+                          booking=open1.booking or open2.booking)
+
+
+def merge_duplicates(entries, positions):
+    """Merge the Open and Close directives that renames made duplicates of.
+
+    Keeps a single Open, with the earliest date and the union of currencies, and a single Close, on the
+    latest date. If some of the merged accounts were never closed, the merged account stays open: all its
+    Closes are dropped.
+
+    Args:
+      entries: the list of renamed entries, modified in place
+      positions: a dict mapping each account to the indexes of its Open and Close directives in entries
+    Returns:
+      The list of entries, without the dropped duplicates.
+    """
+    dropped = set()
+    for indexes in positions.values():
+        opens = [i for i in indexes if isinstance(entries[i], data.Open)]
+        closes = [i for i in indexes if isinstance(entries[i], data.Close)]
+        if len(opens) > 1:
+            first = min(opens, key=lambda i: entries[i].date)
+            for i in opens:
+                if i != first:
+                    entries[first] = merge_opens(entries[first], entries[i])
+                    dropped.add(i)
+            if len(closes) < len(opens):
+                dropped.update(closes)
+                continue
+        if len(closes) > 1:
+            last = max(closes, key=lambda i: entries[i].date)
+            dropped.update(i for i in closes if i != last)
+    if not dropped:
+        return entries
+    return [entry for i, entry in enumerate(entries) if i not in dropped]
+
+
 def rename_accounts(entries, options_map, config):  # noqa: C901
     """Insert entries for unmatched transactions in zero-sum accounts.
 
@@ -18,7 +186,9 @@ def rename_accounts(entries, options_map, config):  # noqa: C901
       options_map: a dict of options parsed from the file (not used)
 
       config: A configuration string, which is intended to be a Python dict
-      listing renames. Eg: "{'Expenses:Taxes' : 'Income:Taxes'}"
+      listing renames. Eg: "{'Expenses:Taxes' : 'Income:Taxes'}". To also rename
+      accounts held in metadata values and Custom directives, a dict of renames
+      and options. Eg: "{'renames': {...}, 'metadata_keys': ['budget'], 'custom': True}"
 
     Returns:
       A tuple of entries and errors. """
@@ -28,23 +198,9 @@ def rename_accounts(entries, options_map, config):  # noqa: C901
     new_entries = []
     errors = []
 
-    renames = dict([(re.compile(pattern), replacement)
-                    for pattern, replacement in literal_eval(config).items()])
-
-    def rename_account(account):
-        """Apply 'renames' to 'account'.
-
-        Return the resulting account name and whether or not it was renamed.
-
-        """
-        nonlocal rename_count
-        was_renamed = False
-        for pattern, replacement in renames.items():
-            account, num_replacements = pattern.subn(replacement, account)
-            if num_replacements > 0:
-                rename_count += 1
-                was_renamed = True
-        return account, was_renamed
+    renames, metadata_keys, custom = parse_config(config)
+    rename_account = make_renamer(*compile_renames(renames))
+    open_close_positions = collections.defaultdict(list)
 
     def rename_account_in_entry(entry, account_attr='account'):
         """Apply 'renames' to 'getattr(entry, account_attr)'.
@@ -52,30 +208,39 @@ def rename_accounts(entries, options_map, config):  # noqa: C901
         Return the resulting entry and whether or not it was renamed.
 
         """
+        nonlocal rename_count
         old_account = getattr(entry, account_attr)
         new_account, was_renamed = rename_account(old_account)
+        rename_count += was_renamed
         new_entry = entry._replace(**{account_attr: new_account}) if was_renamed else entry
         return new_entry, was_renamed
 
     for entry in entries:
         if isinstance(entry, data.Transaction):
-            new_postings = []
-            any_posting_changed = False
-            for posting in entry.postings:
-                new_posting, was_renamed = rename_account_in_entry(posting)
-                any_posting_changed = any_posting_changed or was_renamed
-                new_postings.append(new_posting)
-            new_entry = entry._replace(postings=new_postings) if any_posting_changed else entry
+            # Transactions with no renamed postings are passed through as is
+            if any(rename_account(posting.account)[1] for posting in entry.postings):
+                new_postings = [rename_account_in_entry(posting)[0] for posting in entry.postings]
+                new_entry = entry._replace(postings=new_postings)
+            else:
+                new_entry = entry
         elif isinstance(entry, data.Pad):
             new_entry, _ = rename_account_in_entry(entry, 'account')
             new_entry, _ = rename_account_in_entry(new_entry, 'source_account')
+        elif isinstance(entry, (data.Open, data.Close)):
+            new_entry, _ = rename_account_in_entry(entry)
+            open_close_positions[new_entry.account].append(len(new_entries))
         elif hasattr(entry, 'account'):
             new_entry, _ = rename_account_in_entry(entry)
         else:
             new_entry = entry
 
+        if metadata_keys or custom:
+            new_entry = rename_values(new_entry, rename_account, metadata_keys, custom)
         new_entries.append(new_entry)
 
+    # Renaming several accounts to one duplicates their Open and Close directives
+    new_entries = merge_duplicates(new_entries, open_close_positions)
+
     if DEBUG:
         elapsed_time = time.time() - start_time
         print("Rename accounts [{:.2f}s]: {} postings renamed.".format(elapsed_time, rename_count))
@@ -216,3 +216,129 @@ class TestUnrealized(cmptest.TestCase):
               Assets:Brokerage:Cash -10 USD
               Assets:Brokerage:Fees 10 USD
         """, new_entries)
+
+    @loader.load_doc()
+    def test_unchanged_transactions_shared(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Account1
+        2014-01-01 open Assets:Account2
+        2014-01-01 open Expenses:Taxes
+
+        2014-01-15 *
+          Assets:Account1
+          Assets:Account2 -1000 USD
+
+        2014-01-16 *
+          Assets:Account2
+          Expenses:Taxes          1000 USD
+
+        2014-01-17 *
+          Assets:Account2
+          Expenses:Taxes          1000 USD
+        """
+        config = "{'Expenses:Taxes' : 'Income:Taxes'}"
+        new_entries, _ = rename_accounts.rename_accounts(entries, options_map, config)
+
+        self.assertIs(entries[3], new_entries[3])
+        self.assertEqual(['Assets:Account2', 'Income:Taxes'], [p.account for p in new_entries[4].postings])
+        self.assertEqual(['Assets:Account2', 'Income:Taxes'], [p.account for p in new_entries[5].postings])
+
+    def test_renamer(self):
+        renames = {
+            'Expenses:Taxes': 'Income:Taxes',
+            'Income:Taxes:(.+)': 'Income:Taxes:Withheld:\\1',
+            'Opening-Balances': 'OpeningBalances',
+        }
+        compiled, any_match = rename_accounts.compile_renames(renames)
+        self.assertEqual([True, False, True], [literal for literal, _, _ in compiled])
+        self.assertIsNotNone(any_match)
+        rename_account = rename_accounts.make_renamer(compiled, any_match)
+
+        # Applied in order: the second rename applies to the result of the first
+        self.assertEqual(('Income:Taxes:Withheld:Federal', True), rename_account('Expenses:Taxes:Federal'))
+        self.assertEqual(('Income:Taxes', True), rename_account('Expenses:Taxes'))
+        self.assertEqual(('Equity:OpeningBalances', True), rename_account('Equity:Opening-Balances'))
+        self.assertEqual(('Assets:Bank', False), rename_account('Assets:Bank'))
+
+        # The first rename listed that matches wins, even if a later one matches further left
+        compiled, any_match = rename_accounts.compile_renames({':Bar': ':Baz', 'Foo': 'Qux'})
+        self.assertEqual('_rename0', any_match.match('Assets:Foo:Bar').lastgroup)
+        rename_account = rename_accounts.make_renamer(compiled, any_match)
+        self.assertEqual(('Assets:Qux:Baz', True), rename_account('Assets:Foo:Bar'))
+        self.assertEqual(('Assets:Qux', True), rename_account('Assets:Foo'))
+
+        # Patterns with backreferences can't be combined, but still work
+        compiled, any_match = rename_accounts.compile_renames({'Assets:(\\w+):\\1': 'Assets:\\1'})
+        self.assertIsNone(any_match)
+        rename_account = rename_accounts.make_renamer(compiled, any_match)
+        self.assertEqual(('Assets:Bank', True), rename_account('Assets:Bank:Bank'))
+        self.assertEqual(('Assets:Bank:Cash', False), rename_account('Assets:Bank:Cash'))
+
+    @loader.load_doc()
+    def test_merge_duplicates(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Bank
+        2014-02-01 open Liabilities:OldCard1 USD
+        2014-01-01 open Liabilities:OldCard2 EUR,USD
+        2014-03-01 open Liabilities:OldCard3
+        2014-03-01 open Liabilities:OldCard4 USD
+        2015-01-01 close Liabilities:OldCard1
+        2015-06-01 close Liabilities:OldCard2
+        2015-01-01 close Liabilities:OldCard3
+
+        2014-04-01 *
+          Liabilities:OldCard1  -10 USD
+          Assets:Bank
+        """
+        config = """{
+            'Liabilities:OldCard[12]': 'Liabilities:Card',
+            'Liabilities:OldCard[34]': 'Liabilities:Card2',
+        }"""
+        new_entries, _ = rename_accounts.rename_accounts(entries, options_map, config)
+
+        self.assertEqualEntries("""
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Liabilities:Card USD,EUR
+        2014-03-01 open Liabilities:Card2
+        2015-06-01 close Liabilities:Card
+
+        2014-04-01 *
+          Liabilities:Card  -10 USD
+          Assets:Bank        10 USD
+        """, new_entries)
+
+    @loader.load_doc()
+    def test_metadata_and_custom(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Account1
+        2014-01-01 open Expenses:Taxes
+          budget: "Expenses:Taxes"
+
+        2014-01-16 *
+          source: "Expenses:Taxes"
+          Assets:Account1
+          Expenses:Taxes          1000 USD
+            budget: "Expenses:Taxes:Federal"
+            note: "Expenses:Taxes"
+
+        2014-12-31 custom "budget" Expenses:Taxes "monthly" 45.30 USD
+        """
+        renames = "{'Expenses:Taxes' : 'Income:Taxes'}"
+
+        # Off by default
+        new_entries, _ = rename_accounts.rename_accounts(entries, options_map, renames)
+        self.assertEqual('Expenses:Taxes', new_entries[1].meta['budget'])
+        self.assertEqual('Expenses:Taxes', new_entries[-1].values[0].value)
+
+        config = "{{'renames': {}, 'metadata_keys': ['budget', 'source'], 'custom': True}}".format(renames)
+        new_entries, _ = rename_accounts.rename_accounts(entries, options_map, config)
+        self.assertEqual('Income:Taxes', new_entries[1].meta['budget'])
+        txn = new_entries[2]
+        self.assertEqual('Income:Taxes', txn.meta['source'])
+        self.assertEqual('Income:Taxes:Federal', txn.postings[1].meta['budget'])
+        self.assertEqual('Expenses:Taxes', txn.postings[1].meta['note'])
+        self.assertEqual(['Income:Taxes', 'monthly'], [v.value for v in new_entries[-1].values][:2])
+
+        # The input is untouched
+        self.assertEqual('Expenses:Taxes', entries[1].meta['budget'])
+        self.assertEqual('Expenses:Taxes:Federal', entries[2].postings[1].meta['budget'])